@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+import os, sys, json, time, glob, math, shutil, platform, tempfile, subprocess, argparse
+import numpy
+from LightLayout import LightLayout
+from RenderContainer import Pack
+
+# Times the things that have to keep up: LightRender turning a video into
+# light data, the generators making frames, and viewer.py getting frames
+# and drawing them.  Everything runs on inputs made up here, in a scratch
+# directory: test videos from ffmpeg's testsrc, and square grid layouts of
+# however many lights.  Each case is its own process, so it can have its
+# own LIGHT_LAYOUT and its peak memory can be measured on its own.
+#
+# Results are JSON, a list of cases that each say what was run and how it
+# went, and --compare lines a run up against an earlier one.  --check runs
+# the same way on the same inputs, but checks that different ways of
+# getting the same frames agree instead of timing them.
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_VERSION = 1
+
+BENCHMARKS = ["render", "generate", "view"]
+DEFAULT_RESOLUTIONS = ["320x240", "1280x720", "1920x1080"]
+DEFAULT_DURATIONS = [10]
+DEFAULT_LIGHT_COUNTS = [1000, 5000]
+DEFAULT_VIEW_FRAMES = 1000
+
+# testsrc frames a second, which LightRender then resamples to FPS
+SOURCE_FRAME_RATE = 30
+
+# LightRender's flags for each way of decoding and sampling the lights.
+# point uses whichever decoder LightRender would pick by default.
+RENDER_MODES = {
+	"point": [],
+	"point-ffmpeg": ["-d", "ffmpeg"],
+	"ffmpeg-area": ["-s", "area"],
+	"area-box": ["-a", "box"],
+}
+
+GENERATOR_SCRIPTS = ["simple_rainbow*.py", "rainbow_*.py"]
+
+# The generator whose frames the viewer is timed on
+VIEW_SOURCE_GENERATOR = "rainbow_sat"
+
+VIEW_SOURCES = ["raw", "container"]
+
+CHECKS = ["sampling", "live"]
+
+# The sampling check's layout is a 70x70 grid, whose 14 unit cells don't
+# divide the LightPosition grid evenly
+CHECK_LIGHT_COUNT = 4900
+CHECK_RESOLUTION = "1280x720"
+CHECK_DURATION = 2
+
+# The live check reads its video at its own frame rate, so it's kept small,
+# and its queue holds every frame so none are dropped if the machine is busy
+CHECK_LIVE_RESOLUTION = "320x240"
+CHECK_LIVE_QUEUE_FRAMES = 1000
+
+# ffmpeg's area scaler rounds each cell's edges to whole pixels, so it can
+# be a little off from the box sampler on the lines of testsrc
+SAMPLING_TOLERANCE = 16
+
+monotonic = getattr(time, "monotonic", time.time)
+
+def Log(message):
+	sys.stderr.write(message + "\n")
+	sys.stderr.flush()
+
+def RunTimed(cmd, env=None, cwd=None, captureOutput=False, verbose=False):
+	# Runs cmd to the end.  Returns how long it took, its peak RSS in kB
+	# (Linux counts whatever it ran too, like ffmpeg), and what it printed
+	# if captureOutput.
+	devnull = open(os.devnull, "wb")
+	started = monotonic()
+	process = subprocess.Popen(cmd, env=env, cwd=cwd,
+		stdout=subprocess.PIPE if captureOutput else (None if verbose else devnull),
+		stderr=None if verbose else devnull)
+	output = process.stdout.read() if captureOutput else None
+	pid, status, usage = os.wait4(process.pid, 0)
+	seconds = monotonic() - started
+	process.returncode = status
+	devnull.close()
+	if status:
+		raise RuntimeError("%s failed with status %d" % (" ".join(cmd), status))
+	return seconds, usage.ru_maxrss, output
+
+def MakeVideo(scratchPath, resolution, seconds):
+	videoPath = os.path.join(scratchPath, "testsrc-%s-%ds.mp4" % (resolution, seconds))
+	if not os.path.exists(videoPath):
+		Log("Making a %ds %s test video" % (seconds, resolution))
+		RunTimed([
+			"ffmpeg", "-nostdin", "-y", "-f", "lavfi",
+			"-i", "testsrc=size=%s:rate=%d:duration=%d" % (resolution, SOURCE_FRAME_RATE, seconds),
+			"-pix_fmt", "yuv420p", videoPath])
+	return videoPath
+
+def MakeLayout(scratchPath, lightCount):
+	# As square a grid as holds lightCount lights
+	columns = int(math.ceil(math.sqrt(lightCount)))
+	lights = numpy.arange(lightCount)
+	layout = LightLayout(lights % columns, lights // columns)
+	layoutPath = os.path.join(scratchPath, "grid-%d.csv" % lightCount)
+	with open(layoutPath, "w") as layoutFile:
+		layoutFile.write(layout.ToCsv())
+	return layoutPath
+
+def LayoutEnvironment(layoutPath):
+	env = dict(os.environ)
+	env.pop("LIGHT_LAYOUT", None)
+	if layoutPath:
+		env["LIGHT_LAYOUT"] = layoutPath
+	return env
+
+def FramesPerSecond(frames, seconds):
+	return frames / seconds if seconds else 0.0
+
+def RenderResourcesPath(scratchPath):
+	# LightRender always works on Resources/video.mp4 under where it's run
+	return os.path.join(scratchPath, "render", "Resources")
+
+def BenchmarkRender(scratchPath, videoPath, lightCount, layoutPath, mode, jobs, verbose):
+	resourcesPath = RenderResourcesPath(scratchPath)
+	runPath = os.path.dirname(resourcesPath)
+	if not os.path.isdir(os.path.join(resourcesPath, "Frames")):
+		os.makedirs(os.path.join(resourcesPath, "Frames"))
+	sourcePath = os.path.join(resourcesPath, "video.mp4")
+	if os.path.lexists(sourcePath):
+		os.unlink(sourcePath)
+	os.symlink(os.path.abspath(videoPath), sourcePath)
+	outputPath = os.path.join(resourcesPath, "video.bin")
+	if os.path.exists(outputPath):
+		os.unlink(outputPath)
+
+	cmd = [sys.executable, os.path.join(SCRIPT_PATH, "LightRender.py"), "--cache-size", "0",
+		"--jobs", str(jobs)] + RENDER_MODES[mode]
+	seconds, peakRss, output = RunTimed(cmd, LayoutEnvironment(layoutPath), runPath, verbose=verbose)
+	frames = os.path.getsize(outputPath) // (lightCount * 3)
+	return {"frames": frames, "seconds": seconds,
+		"framesPerSecond": FramesPerSecond(frames, seconds), "peakRssKb": peakRss}
+
+def BenchmarkGenerator(scratchPath, scriptPath, lightCount, layoutPath, verbose):
+	name = os.path.splitext(os.path.basename(scriptPath))[0]
+	outputPath = os.path.join(scratchPath, "%s-%d.bin" % (name, lightCount))
+	cmd = [sys.executable, scriptPath, "-f", "0", "-o", outputPath]
+	seconds, peakRss, output = RunTimed(cmd, LayoutEnvironment(layoutPath), verbose=verbose)
+	frames = os.path.getsize(outputPath) // (lightCount * 3)
+	return outputPath, {"frames": frames, "seconds": seconds,
+		"framesPerSecond": FramesPerSecond(frames, seconds), "peakRssKb": peakRss}
+
+def BenchmarkView(framesPath, layoutPath, frameCount, useSurfarray, verbose):
+	cmd = [sys.executable, os.path.abspath(__file__), "--view-worker", framesPath,
+		"--view-frames", str(frameCount)]
+	if useSurfarray:
+		cmd.append("--surfarray")
+	env = LayoutEnvironment(layoutPath)
+	env["SDL_VIDEODRIVER"] = "dummy"
+	env["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+	seconds, peakRss, output = RunTimed(cmd, env, captureOutput=True, verbose=verbose)
+	results = json.loads(output.decode().strip().splitlines()[-1])
+	results["peakRssKb"] = peakRss
+	return results
+
+def ViewWorker(framesPath, frameCount, useSurfarray):
+	# Runs in its own process, with the layout and SDL set up by
+	# BenchmarkView.  Gets and draws frames as fast as it can, timing each
+	# half, and prints the results as the last line.
+	import pygame
+	import viewer
+
+	pygame.init()
+	screen = pygame.display.set_mode(viewer.SCREEN.size)
+	started = monotonic()
+	canvas = viewer.LightCanvas(screen, viewer.LAYOUT, use_surfarray=useSurfarray)
+	setupSeconds = monotonic() - started
+
+	getSeconds = drawSeconds = 0.0
+	shown = 0
+	with open(framesPath, "rb") as fin:
+		fin, container = viewer.OpenRender(fin)
+		frames = viewer.open_frames(fin, container)
+		while shown < frameCount:
+			started = monotonic()
+			nextFrame = frames.get()
+			got = monotonic()
+			if nextFrame is None:
+				break
+			pygame.display.update(canvas.draw(nextFrame[1]))
+			drawn = monotonic()
+			getSeconds += got - started
+			drawSeconds += drawn - got
+			shown += 1
+
+	print(json.dumps({
+		"frames": shown,
+		"setupSeconds": setupSeconds,
+		"getMs": 1000 * getSeconds / max(shown, 1),
+		"drawMs": 1000 * drawSeconds / max(shown, 1),
+		"framesPerSecond": FramesPerSecond(shown, getSeconds + drawSeconds),
+	}))
+
+def CheckSampling(scratchPath, verbose):
+	# Sampling the lights' cells inside ffmpeg has to pick out the same
+	# cells as sampling them here, even when they don't divide the grid
+	videoPath = MakeVideo(scratchPath, CHECK_RESOLUTION, CHECK_DURATION)
+	layoutPath = MakeLayout(scratchPath, CHECK_LIGHT_COUNT)
+	outputs = {}
+	for mode in ("ffmpeg-area", "area-box"):
+		BenchmarkRender(scratchPath, videoPath, CHECK_LIGHT_COUNT, layoutPath, mode, 1, verbose)
+		outputs[mode] = numpy.fromfile(
+			os.path.join(RenderResourcesPath(scratchPath), "video.bin"), dtype=numpy.uint8)
+
+	if len(outputs["ffmpeg-area"]) != len(outputs["area-box"]) or not len(outputs["area-box"]):
+		return False, "ffmpeg-area rendered %d bytes and area-box %d" % (
+			len(outputs["ffmpeg-area"]), len(outputs["area-box"]))
+	difference = numpy.abs(
+		outputs["ffmpeg-area"].astype(int) - outputs["area-box"].astype(int)).max()
+	return difference <= SAMPLING_TOLERANCE, \
+		"ffmpeg-area and area-box differ by up to %d" % difference
+
+def CheckLive(scratchPath, verbose):
+	# A file read with --live stands in for a camera, so it has to give
+	# every frame of the file, in order, just as rendering the file does
+	from constants import LAYOUT
+	videoPath = MakeVideo(scratchPath, CHECK_LIVE_RESOLUTION, CHECK_DURATION)
+	BenchmarkRender(scratchPath, videoPath, LAYOUT.lightCount, None, "point-ffmpeg", 1, verbose)
+	rendered = numpy.fromfile(
+		os.path.join(RenderResourcesPath(scratchPath), "video.bin"), dtype=numpy.uint8)
+
+	livePath = os.path.join(scratchPath, "live.bin")
+	RunTimed([sys.executable, os.path.join(SCRIPT_PATH, "LightRender.py"),
+		"--live", os.path.abspath(videoPath), "--live-size", CHECK_LIVE_RESOLUTION,
+		"--live-queue", str(CHECK_LIVE_QUEUE_FRAMES), "--live-output", livePath],
+		LayoutEnvironment(None), verbose=verbose)
+	live = numpy.fromfile(livePath, dtype=numpy.uint8)
+
+	frameBytes = LAYOUT.lightCount * 3
+	message = "live gave %d frames of the %d rendered" % (
+		len(live) // frameBytes, len(rendered) // frameBytes)
+	if not len(rendered) or len(live) != len(rendered):
+		return False, message
+	if not numpy.array_equal(live, rendered):
+		firstDifferent = numpy.flatnonzero(live != rendered)[0] // frameBytes
+		return False, message + ", differing from frame %d" % firstDifferent
+	return True, message + ", all the same"
+
+CHECK_FUNCTIONS = {
+	"sampling": CheckSampling,
+	"live": CheckLive,
+}
+
+def RunChecks(args, scratchPath):
+	# As with the benchmarks, the default layout is what constants.py has
+	# when LIGHT_LAYOUT isn't set
+	os.environ.pop("LIGHT_LAYOUT", None)
+	passed = True
+	for check in args.checks:
+		checkPassed, message = CHECK_FUNCTIONS[check](scratchPath, args.verbose)
+		Log("%-8s %s: %s" % (check, "ok" if checkPassed else "FAILED", message))
+		passed = passed and checkPassed
+	return passed
+
+def CaseKey(case):
+	return case["benchmark"], json.dumps(case["case"], sort_keys=True)
+
+def Compare(oldResults, newResults):
+	# One line per case in both runs, with how its frame rate changed
+	oldCases = dict((CaseKey(case), case) for case in oldResults["cases"])
+	lines = []
+	for case in newResults["cases"]:
+		oldCase = oldCases.get(CaseKey(case))
+		if not oldCase or not oldCase["framesPerSecond"]:
+			continue
+		change = case["framesPerSecond"] / oldCase["framesPerSecond"] - 1
+		lines.append("%-8s %-60s %10.1f -> %10.1f fps  %+6.1f%%" % (
+			case["benchmark"], " ".join("%s=%s" % item for item in sorted(case["case"].items())),
+			oldCase["framesPerSecond"], case["framesPerSecond"], 100 * change))
+	return "\n".join(lines)
+
+def ParseList(text, itemType=str):
+	return [itemType(item) for item in text.split(",") if item.strip()]
+
+def RunBenchmarks(args, scratchPath):
+	# Whatever constants.py has when LIGHT_LAYOUT isn't set is the default
+	# layout, and the other light counts get grids
+	os.environ.pop("LIGHT_LAYOUT", None)
+	from constants import LAYOUT, FPS
+	layouts = [(LAYOUT.lightCount, None)]
+	for lightCount in args.lights:
+		if lightCount != LAYOUT.lightCount:
+			layouts.append((lightCount, MakeLayout(scratchPath, lightCount)))
+
+	cases = []
+	def Record(benchmark, case, results):
+		Log("%-8s %s: %.1f fps" % (benchmark,
+			" ".join("%s=%s" % item for item in sorted(case.items())), results["framesPerSecond"]))
+		record = {"benchmark": benchmark, "case": case}
+		record.update(results)
+		cases.append(record)
+
+	if "render" in args.only:
+		for resolution in args.resolutions:
+			for duration in args.durations:
+				videoPath = MakeVideo(scratchPath, resolution, duration)
+				for lightCount, layoutPath in layouts:
+					for mode in args.modes:
+						Record("render", {"resolution": resolution, "duration": duration,
+							"lights": lightCount, "mode": mode, "jobs": args.jobs},
+							BenchmarkRender(scratchPath, videoPath, lightCount, layoutPath,
+								mode, args.jobs, args.verbose))
+
+	scripts = sorted(set(path for pattern in GENERATOR_SCRIPTS
+		for path in glob.glob(os.path.join(SCRIPT_PATH, pattern))))
+	if args.generators:
+		scripts = [path for path in scripts
+			if os.path.splitext(os.path.basename(path))[0] in args.generators]
+	viewSources = {}
+	if "generate" in args.only or "view" in args.only:
+		for lightCount, layoutPath in layouts:
+			for scriptPath in scripts:
+				name = os.path.splitext(os.path.basename(scriptPath))[0]
+				if "generate" not in args.only and name != VIEW_SOURCE_GENERATOR:
+					continue
+				outputPath, results = BenchmarkGenerator(
+					scratchPath, scriptPath, lightCount, layoutPath, args.verbose)
+				if name == VIEW_SOURCE_GENERATOR:
+					viewSources[lightCount] = outputPath
+				if "generate" in args.only:
+					Record("generate", {"generator": name, "lights": lightCount}, results)
+
+	if "view" in args.only:
+		for lightCount, layoutPath in layouts:
+			rawPath = viewSources.get(lightCount)
+			if rawPath is None:
+				Log("No %s frames to view with %d lights" % (VIEW_SOURCE_GENERATOR, lightCount))
+				continue
+			containerPath = os.path.splitext(rawPath)[0] + ".lrc"
+			with open(rawPath, "rb") as rawFile:
+				Pack(rawFile, containerPath, lightCount, FPS, "zlib", 60 * FPS)
+			sourcePaths = {"raw": rawPath, "container": containerPath}
+			for source in VIEW_SOURCES:
+				framesPath = sourcePaths[source]
+				for useSurfarray in (False, True):
+					Record("view", {"lights": lightCount, "source": source,
+						"draw": "surfarray" if useSurfarray else "lights"},
+						BenchmarkView(framesPath, layoutPath, args.view_frames,
+							useSurfarray, args.verbose))
+
+	return {
+		"version": BENCHMARK_VERSION,
+		"started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version(),
+		"numpy": numpy.__version__,
+		"platform": platform.platform(),
+		"cpus": os.cpu_count() if hasattr(os, "cpu_count") else None,
+		"cases": cases,
+	}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Time rendering, generating and viewing on synthetic inputs, '
+		'and write the results as JSON')
+	parser.add_argument('-o', '--output', default=None,
+		help='Write the JSON results here instead of stdout')
+	parser.add_argument('--compare', type=argparse.FileType('r'), default=None,
+		help='Results of an earlier run to print this one against')
+	parser.add_argument('--only', type=ParseList, default=BENCHMARKS,
+		help='Comma separated benchmarks to run, of %s' % ", ".join(BENCHMARKS))
+	parser.add_argument('--resolutions', type=ParseList, default=DEFAULT_RESOLUTIONS,
+		help='Comma separated test video sizes (default %s)' % ",".join(DEFAULT_RESOLUTIONS))
+	parser.add_argument('--durations', type=lambda text: ParseList(text, int),
+		default=DEFAULT_DURATIONS,
+		help='Comma separated test video lengths in seconds (default %s)' % ",".join(
+			str(duration) for duration in DEFAULT_DURATIONS))
+	parser.add_argument('--lights', type=lambda text: ParseList(text, int),
+		default=DEFAULT_LIGHT_COUNTS,
+		help='Comma separated light counts to lay out on grids, as well as the '
+		'default layout (default %s)' % ",".join(str(count) for count in DEFAULT_LIGHT_COUNTS))
+	parser.add_argument('--modes', type=ParseList, default=sorted(RENDER_MODES),
+		help='Comma separated LightRender sampling modes, of %s' % ", ".join(sorted(RENDER_MODES)))
+	parser.add_argument('--generators', type=ParseList, default=None,
+		help='Comma separated generators to time (default all of them)')
+	parser.add_argument('-j', '--jobs', type=int, default=1,
+		help='Pass --jobs to LightRender')
+	parser.add_argument('--view-frames', dest='view_frames', type=int, default=DEFAULT_VIEW_FRAMES,
+		help='Frames to get and draw in each viewer case')
+	parser.add_argument('--check', dest='checks', nargs='?', type=ParseList, const=CHECKS,
+		default=None,
+		help='Instead of timing anything, check that the ways of getting the same '
+		'frames agree (comma separated, of %s; default all of them)' % ", ".join(CHECKS))
+	parser.add_argument('--keep', action='store_true', default=False,
+		help='Leave the scratch directory with the test inputs and outputs')
+	parser.add_argument('-v', '--verbose', action='store_true', default=False,
+		help='Let everything that runs print what it prints')
+	parser.add_argument('--view-worker', dest='view_worker', default=None,
+		help=argparse.SUPPRESS)
+	parser.add_argument('--surfarray', action='store_true', default=False,
+		help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.view_worker:
+		ViewWorker(args.view_worker, args.view_frames, args.surfarray)
+		sys.exit(0)
+
+	for benchmark in args.only:
+		if benchmark not in BENCHMARKS:
+			parser.error("There's no %r benchmark" % benchmark)
+	for mode in args.modes:
+		if mode not in RENDER_MODES:
+			parser.error("There's no %r render mode" % mode)
+	for check in args.checks or []:
+		if check not in CHECKS:
+			parser.error("There's no %r check" % check)
+
+	scratchPath = tempfile.mkdtemp(prefix="lightrender-bench-")
+	if args.checks:
+		try:
+			passed = RunChecks(args, scratchPath)
+		finally:
+			if args.keep:
+				Log("Left the test inputs in %s" % scratchPath)
+			else:
+				shutil.rmtree(scratchPath)
+		sys.exit(0 if passed else 1)
+
+	try:
+		results = RunBenchmarks(args, scratchPath)
+	finally:
+		if args.keep:
+			Log("Left the test inputs in %s" % scratchPath)
+		else:
+			shutil.rmtree(scratchPath)
+
+	resultsJson = json.dumps(results, indent=2, sort_keys=True)
+	if args.output:
+		with open(args.output, "w") as outputFile:
+			outputFile.write(resultsJson + "\n")
+	else:
+		print(resultsJson)
+
+	if args.compare:
+		Log(Compare(json.load(args.compare), results))
+
+# vim: set ts=8 sw=8 noet:
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+import os, sys, struct, argparse
+import numpy
+
+# A delta stream is a small header, then one record per frame.  Most frames
+# are only a little different from the one before, so rather than all the
+# lights, a delta record only carries the runs of lights that changed.
+# Every so often there's a keyframe with all of them, so something joining
+# the stream part way through doesn't have to wait long to catch up.
+#
+# Header:    magic, version, light count, keyframe interval
+# Keyframe:  KEYFRAME, then every light's rgb
+# Delta:     DELTA, varint payload size, then a payload of (varint lights
+#            unchanged, varint lights changed, their rgb) runs.  Lights
+#            after the last run are unchanged, so an empty payload repeats
+#            the previous frame.
+DELTA_MAGIC = b"LRDS"
+DELTA_VERSION = 1
+HEADER_FORMAT = "<4sHII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+KEYFRAME = 0x4b
+DELTA = 0x44
+
+DEFAULT_KEYFRAME_INTERVAL = 100
+
+def EncodeVarint(value):
+	encoded = bytearray()
+	while value > 0x7f:
+		encoded.append(0x80 | (value & 0x7f))
+		value >>= 7
+	encoded.append(value)
+	return encoded
+
+def DecodeVarint(data, offset):
+	value = 0
+	shift = 0
+	while True:
+		byte = data[offset]
+		offset += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, offset
+		shift += 7
+
+class DeltaEncoder:
+	def __init__(self, lightCount, keyframeInterval=DEFAULT_KEYFRAME_INTERVAL):
+		self.lightCount = lightCount
+		self.keyframeInterval = keyframeInterval
+		self.previousFrame = None
+		self.framesSinceKeyframe = 0
+
+	def Header(self):
+		return struct.pack(HEADER_FORMAT, DELTA_MAGIC, DELTA_VERSION,
+			self.lightCount, self.keyframeInterval)
+
+	def Encode(self, frame):
+		# frame is one frame of raw rgb; returns its record
+		frame = numpy.frombuffer(frame, dtype=numpy.uint8).reshape(self.lightCount, 3)
+		if self.previousFrame is None or self.framesSinceKeyframe + 1 >= self.keyframeInterval:
+			return self._Keyframe(frame)
+
+		changedLights = numpy.flatnonzero((frame != self.previousFrame).any(axis=1))
+		payload = bytearray()
+		if len(changedLights):
+			# Split the changed lights wherever there's a gap between them
+			gaps = numpy.diff(changedLights) > 1
+			runStarts = changedLights[numpy.concatenate(([True], gaps))]
+			runEnds = changedLights[numpy.concatenate((gaps, [True]))] + 1
+			position = 0
+			for runStart, runEnd in zip(runStarts.tolist(), runEnds.tolist()):
+				payload += EncodeVarint(runStart - position)
+				payload += EncodeVarint(runEnd - runStart)
+				payload += frame[runStart:runEnd].tobytes()
+				position = runEnd
+
+		# When nearly everything changes a keyframe is no bigger, and gives
+		# late joiners somewhere to start
+		if len(payload) >= frame.nbytes:
+			return self._Keyframe(frame)
+
+		self.previousFrame = frame
+		self.framesSinceKeyframe += 1
+		return bytes(bytearray([DELTA]) + EncodeVarint(len(payload)) + payload)
+
+	def _Keyframe(self, frame):
+		self.previousFrame = frame
+		self.framesSinceKeyframe = 0
+		return bytes(bytearray([KEYFRAME])) + frame.tobytes()
+
+class DeltaReader:
+	# Reads a delta stream as if it were a raw render, like ContainerReader
+	# does for containers.  Deltas only make sense in order, so it can't
+	# seek.  magic is whatever has already been read from the start of
+	# fileObject.
+	def __init__(self, fileObject, magic=b""):
+		self.fileObject = fileObject
+		header = magic + self._ReadExactly(HEADER_SIZE - len(magic))
+		magic, version, self.lightCount, self.keyframeInterval = struct.unpack(
+			HEADER_FORMAT, header)
+		if magic != DELTA_MAGIC:
+			raise ValueError("Not a delta stream")
+		if version > DELTA_VERSION:
+			raise ValueError("Delta stream version %d is too new" % version)
+		self.frameBytes = self.lightCount * 3
+
+		self.currentFrame = None
+		self.frameNumber = 0
+
+		# Decoded bytes that haven't been read yet
+		self.pending = b""
+
+	def _ReadExactly(self, size):
+		data = self.fileObject.read(size)
+		if len(data) != size:
+			raise IOError("Delta stream is truncated")
+		return data
+
+	def _ReadVarint(self):
+		value = 0
+		shift = 0
+		while True:
+			byte = bytearray(self._ReadExactly(1))[0]
+			value |= (byte & 0x7f) << shift
+			if byte < 0x80:
+				return value
+			shift += 7
+
+	def ReadFrame(self):
+		# The next frame, or None once the stream ends
+		while True:
+			recordType = self.fileObject.read(1)
+			if not recordType:
+				return None
+			recordType = bytearray(recordType)[0]
+			if recordType == KEYFRAME:
+				frame = self.fileObject.read(self.frameBytes)
+				if len(frame) < self.frameBytes:
+					# A cut off record at the end is just the end
+					return None
+				self.currentFrame = bytearray(frame)
+			elif recordType == DELTA:
+				try:
+					payload = bytearray(self._ReadExactly(self._ReadVarint()))
+				except IOError:
+					return None
+				if self.currentFrame is None:
+					# I joined part way; nothing to show until a keyframe
+					continue
+				self._ApplyDelta(payload)
+			else:
+				raise IOError("Delta stream record type %d is unknown" % recordType)
+
+			self.frameNumber += 1
+			return bytes(self.currentFrame)
+
+	def _ApplyDelta(self, payload):
+		light = 0
+		offset = 0
+		while offset < len(payload):
+			unchanged, offset = DecodeVarint(payload, offset)
+			changed, offset = DecodeVarint(payload, offset)
+			light += unchanged
+			self.currentFrame[light * 3:(light + changed) * 3] = \
+				payload[offset:offset + changed * 3]
+			offset += changed * 3
+			light += changed
+
+	def read(self, size=-1):
+		while size < 0 or len(self.pending) < size:
+			frame = self.ReadFrame()
+			if frame is None:
+				break
+			self.pending += frame
+		if size < 0:
+			size = len(self.pending)
+		data, self.pending = self.pending[:size], self.pending[size:]
+		return data
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		raise IOError("Can't seek in a delta stream")
+
+	def close(self):
+		self.fileObject.close()
+
+def Encode(inputFile, outputFile, lightCount, keyframeInterval):
+	# Flush after every frame, so this can sit in a live pipeline
+	encoder = DeltaEncoder(lightCount, keyframeInterval)
+	outputFile.write(encoder.Header())
+	rawBytes = encodedBytes = 0
+	while True:
+		frame = inputFile.read(encoder.lightCount * 3)
+		if len(frame) < encoder.lightCount * 3:
+			break
+		record = encoder.Encode(frame)
+		outputFile.write(record)
+		outputFile.flush()
+		rawBytes += len(frame)
+		encodedBytes += len(record)
+	return rawBytes, encodedBytes
+
+def Decode(inputFile, outputFile):
+	reader = DeltaReader(inputFile)
+	while True:
+		frame = reader.ReadFrame()
+		if frame is None:
+			break
+		outputFile.write(frame)
+		outputFile.flush()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Delta code a stream of raw frames, as a filter from stdin to stdout')
+	subparsers = parser.add_subparsers(dest='command')
+
+	encodeParser = subparsers.add_parser('encode', help='Raw frames to a delta stream')
+	encodeParser.add_argument('--lights', type=int, default=None,
+		help='Lights per frame (defaults to the layout in constants.py)')
+	encodeParser.add_argument('-k', '--keyframe-interval', dest='keyframe_interval',
+		type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+		help='Send every light at least this many frames apart')
+	encodeParser.add_argument('-v', '--verbose', action='store_true', default=False,
+		help='Report how much smaller the stream got on stderr')
+
+	subparsers.add_parser('decode', help='A delta stream to raw frames')
+
+	args = parser.parse_args()
+
+	inputFile = getattr(sys.stdin, "buffer", sys.stdin)
+	outputFile = getattr(sys.stdout, "buffer", sys.stdout)
+
+	if args.command == 'encode':
+		if args.keyframe_interval < 1:
+			parser.error("--keyframe-interval has to be at least 1")
+		lightCount = args.lights
+		if lightCount is None:
+			from constants import CARTESIAN_COORDS
+			lightCount = len(CARTESIAN_COORDS)
+		rawBytes, encodedBytes = Encode(inputFile, outputFile, lightCount, args.keyframe_interval)
+		if args.verbose and encodedBytes:
+			sys.stderr.write("%d bytes in, %d bytes out, %.1fx smaller\n" % (
+				rawBytes, encodedBytes, rawBytes / float(encodedBytes)))
+	elif args.command == 'decode':
+		Decode(inputFile, outputFile)
+	else:
+		parser.print_help()
+
+# vim: set ts=8 sw=8 noet:
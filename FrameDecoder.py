@@ -0,0 +1,225 @@
+import subprocess, tempfile
+from fractions import Fraction
+import VideoProbe
+
+try:
+	import av
+except ImportError:
+	av = None
+
+# Decoders turn a video into packed rgb24 frames, exactly fps of them a
+# second, starting from any frame.  Both of these give the same frames:
+#
+#   ffmpeg   runs the ffmpeg command line and reads frames from a pipe.
+#            It can run a cellFilter inside ffmpeg as well (see
+#            LightRender's --scale-in-ffmpeg).
+#   pyav     decodes in this process with PyAV, on the decoder's own
+#            threads, straight to numpy arrays.  Frames the frame rate
+#            doesn't need are never converted to rgb.
+
+# How far before its first frame each parallel segment starts decoding, in
+# seconds, so ffmpeg's fps filter picks the same source frames it would in
+# one pass
+SEGMENT_SEEK_MARGIN_SECONDS = 2
+
+# How much of what ffmpeg said goes in the error when it fails
+FFMPEG_ERROR_LINES = 10
+
+def FFmpegErrorLog():
+	# Somewhere for ffmpeg's stderr to go that can't fill up and stall it
+	return tempfile.TemporaryFile()
+
+def CheckFFmpegExit(ffMpegSubprocess, errorLog, sourcePath):
+	# A failed ffmpeg just ends its output early, which looks the same as a
+	# short video, so its exit status is what says something went wrong
+	if not ffMpegSubprocess.returncode:
+		return
+	errorLog.seek(0)
+	errorLines = errorLog.read().decode("utf-8", "replace").strip().splitlines()
+	raise IOError("ffmpeg failed with status %d reading %s:\n%s" % (
+		ffMpegSubprocess.returncode, sourcePath,
+		"\n".join(errorLines[-FFMPEG_ERROR_LINES:])))
+
+def FrameTime(frameNumber, fps):
+	# ffmpeg durations are microsecond precision, so this is exact for any
+	# fps that divides a second into whole microseconds
+	return "%.6f" % (frameNumber / float(fps))
+
+def BuildFilterGraph(fps, cellFilter=None, skipFrames=0):
+	filters = ["fps=%d" % fps]
+	if skipFrames:
+		# After the fps filter every frame is exactly 1/fps long, so this
+		# drops whole output frames and never shifts a boundary.  The kept
+		# frames are moved back to zero, or ffmpeg would pad the gap.
+		filters.append("trim=start=%s" % FrameTime(skipFrames, fps))
+		filters.append("setpts=PTS-STARTPTS")
+	if cellFilter:
+		filters.append(cellFilter)
+	return ",".join(filters)
+
+class FFmpegDecoder:
+	name = "ffmpeg"
+
+	# threads=0 lets ffmpeg pick how many threads to decode on
+	def __init__(self, sourcePath, fps, threads=0):
+		self.sourcePath = sourcePath
+		self.fps = fps
+		self.threads = threads
+
+	def Probe(self, cachePath=None):
+		return VideoProbe.ProbeVideo(self.sourcePath, cachePath)
+
+	def Frames(self, frameSize, numberOfFrames, firstFrame=0, cellFilter=None):
+		# ffmpeg writes packed rgb24 frames to a pipe, and I read them back
+		# one fixed size buffer at a time.  Nothing is kept once a frame is
+		# sampled, so memory use doesn't depend on the length of the video.
+		print("Streaming frames %d-%d from ffmpeg" % (firstFrame + 1, firstFrame + numberOfFrames))
+		cmd = ["ffmpeg", "-nostdin", "-nostats", "-loglevel", "error"]
+		if self.threads:
+			cmd += ["-threads", "%d" % self.threads]
+		if firstFrame:
+			# Seek to a whole frame a little before the segment, so
+			# timestamps stay on the same 1/fps grid as a render from the
+			# start, then let the filter graph drop the frames before the
+			# segment
+			seekFrame = max(0, firstFrame - SEGMENT_SEEK_MARGIN_SECONDS * self.fps)
+			cmd += ["-ss", FrameTime(seekFrame, self.fps)]
+			filterGraph = BuildFilterGraph(self.fps, cellFilter, firstFrame - seekFrame)
+		else:
+			filterGraph = BuildFilterGraph(self.fps, cellFilter)
+		# The fps filter already spaces the frames evenly, so ffmpeg is told
+		# not to duplicate or drop any more of them on the way out.  That's
+		# -vsync rather than -fps_mode, which ffmpeg before 5.1 doesn't have.
+		cmd += [
+			"-i", self.sourcePath, "-vf", filterGraph, "-vsync", "passthrough",
+			"-frames:v", "%d" % numberOfFrames,
+			"-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+		with FFmpegErrorLog() as errorLog:
+			ffMpegSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errorLog)
+			try:
+				while True:
+					frameBuffer = ffMpegSubprocess.stdout.read(frameSize)
+					if len(frameBuffer) < frameSize:
+						break
+					yield frameBuffer
+			finally:
+				ffMpegSubprocess.stdout.close()
+				ffMpegSubprocess.wait()
+			# Only once every frame was read; stopping early can make
+			# ffmpeg fail writing to the closed pipe
+			CheckFFmpegExit(ffMpegSubprocess, errorLog, self.sourcePath)
+
+class PyAVDecoder:
+	name = "pyav"
+
+	# threads=0 lets the codec pick how many threads to decode on
+	def __init__(self, sourcePath, fps, threads=0):
+		if av is None:
+			raise ImportError("The pyav decoder needs PyAV (pip install av)")
+		self.sourcePath = sourcePath
+		self.fps = fps
+		self.threads = threads
+
+	def Probe(self, cachePath=None):
+		return VideoProbe.ProbeVideo(self.sourcePath, cachePath, self._RunProbe)
+
+	def _RunProbe(self, sourcePath):
+		# The same answers ffprobe gives, from the same fields
+		container = av.open(sourcePath)
+		try:
+			if not container.streams.video:
+				raise IOError("%s has no video stream" % sourcePath)
+			stream = container.streams.video[0]
+			duration = None
+			if container.duration is not None:
+				duration = container.duration / float(av.time_base)
+			elif stream.duration is not None:
+				duration = float(stream.duration * stream.time_base)
+			frameRate = stream.average_rate or stream.base_rate
+			frameRate = float(frameRate) if frameRate else None
+			if stream.frames:
+				frameCount = stream.frames
+			elif duration and frameRate:
+				frameCount = int(round(duration * frameRate))
+			else:
+				frameCount = None
+			return {
+				"duration": duration,
+				"width": stream.codec_context.width,
+				"height": stream.codec_context.height,
+				"frameRate": frameRate,
+				"frameCount": frameCount,
+			}
+		finally:
+			container.close()
+
+	def Frames(self, frameSize, numberOfFrames, firstFrame=0, cellFilter=None):
+		# Frames are picked the way ffmpeg's fps filter picks them: every
+		# source frame's timestamp is rounded to the nearest output frame,
+		# and each output frame is the last source frame at or before it.
+		# Source timestamps are exact fractions, so any segment of a
+		# render picks the same frames a render from the start would.
+		if cellFilter:
+			raise ValueError("The pyav decoder can't run ffmpeg filters")
+		print("Decoding frames %d-%d with PyAV" % (firstFrame + 1, firstFrame + numberOfFrames))
+
+		container = av.open(self.sourcePath)
+		try:
+			stream = container.streams.video[0]
+			stream.thread_type = "AUTO"
+			if self.threads:
+				stream.codec_context.thread_count = self.threads
+			timeBase = Fraction(stream.time_base)
+			startTime = Fraction(container.start_time or 0, av.time_base)
+
+			def OutputFrame(pts):
+				# Halves round up, as ffmpeg's do
+				return int((Fraction(pts) * timeBase - startTime) * self.fps + Fraction(1, 2))
+
+			if firstFrame:
+				# Start from the keyframe before the segment.  Every
+				# source frame from there on is decoded, since later
+				# frames are built from it, but only the ones that end up
+				# as output frames are converted.
+				seekSeconds = Fraction(firstFrame, self.fps) + startTime
+				container.seek(int(seekSeconds / timeBase), stream=stream, backward=True)
+
+			nextFrame = firstFrame
+			lastFrame = firstFrame + numberOfFrames
+			heldFrame = heldRgb = None
+			endFrame = None
+			for frame in container.decode(stream):
+				if frame.pts is None:
+					continue
+				frameNumber = OutputFrame(frame.pts)
+				while heldFrame is not None and nextFrame < min(frameNumber, lastFrame):
+					if heldRgb is None:
+						heldRgb = heldFrame.to_ndarray(format="rgb24")
+					yield heldRgb
+					nextFrame += 1
+				if nextFrame >= lastFrame:
+					return
+				heldFrame, heldRgb = frame, None
+				if getattr(frame, "duration", None):
+					endFrame = OutputFrame(frame.pts + frame.duration)
+
+			# The last frame lasts until the end of the video
+			if endFrame is None:
+				endFrame = nextFrame + 1
+			while heldFrame is not None and nextFrame < min(endFrame, lastFrame):
+				if heldRgb is None:
+					heldRgb = heldFrame.to_ndarray(format="rgb24")
+				yield heldRgb
+				nextFrame += 1
+		finally:
+			container.close()
+
+FRAME_DECODERS = {
+	FFmpegDecoder.name: FFmpegDecoder,
+	PyAVDecoder.name: PyAVDecoder,
+}
+
+def DefaultDecoderName():
+	return PyAVDecoder.name if av is not None else FFmpegDecoder.name
+
+# vim: set ts=8 sw=8 noet:
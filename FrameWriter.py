@@ -0,0 +1,62 @@
+import os
+import numpy
+
+class FrameWriter:
+	# Frames are rendered straight into a preallocated buffer of flushFrames
+	# frames, which is written out and reused whenever it fills up.  The file
+	# only ever grows by whole frames, in order, so if rendering dies part
+	# way the file is still a valid render of everything up to that point,
+	# and memory use doesn't depend on how long the video is.
+	def __init__(self, outputPath, frameShape, flushFrames, onFlush=None):
+		self.outputPath = outputPath
+		self.frameBuffer = numpy.empty((flushFrames,) + tuple(frameShape), dtype=numpy.uint8)
+		self.bufferedFrames = 0
+		self.framesWritten = 0
+		self.onFlush = onFlush
+		self.outputFile = open(outputPath, "wb")
+
+	@property
+	def frameNumber(self):
+		# How many frames have been handed over so far, written out or not
+		return self.framesWritten + self.bufferedFrames
+
+	def FrameSlots(self):
+		# An endless supply of places to render the next frame into.  Each
+		# slot counts as written as soon as it's handed out.
+		while True:
+			if self.bufferedFrames == len(self.frameBuffer):
+				self.Flush()
+			frameSlot = self.frameBuffer[self.bufferedFrames]
+			self.bufferedFrames += 1
+			yield frameSlot
+
+	def WriteFrames(self, frames):
+		# frames is an array of already rendered frames
+		frames = numpy.asarray(frames, dtype=numpy.uint8).reshape(
+			(-1,) + self.frameBuffer.shape[1:])
+		while len(frames):
+			if self.bufferedFrames == len(self.frameBuffer):
+				self.Flush()
+			copyFrames = min(len(frames), len(self.frameBuffer) - self.bufferedFrames)
+			self.frameBuffer[self.bufferedFrames:self.bufferedFrames + copyFrames] = frames[:copyFrames]
+			self.bufferedFrames += copyFrames
+			frames = frames[copyFrames:]
+
+	def Flush(self):
+		if not self.bufferedFrames:
+			return
+		flushed = self.frameBuffer[:self.bufferedFrames]
+		self._WriteChunk(flushed)
+		self.outputFile.flush()
+		os.fsync(self.outputFile.fileno())
+		if self.onFlush:
+			self.onFlush(self.framesWritten, flushed)
+		self.framesWritten += self.bufferedFrames
+		self.bufferedFrames = 0
+
+	def _WriteChunk(self, frames):
+		self.outputFile.write(frames.tobytes())
+
+	def Close(self):
+		self.Flush()
+		self.outputFile.close()
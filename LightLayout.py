@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+import os, sys, csv, json, math, argparse
+import numpy
+from LightPosition import LightPosition
+
+# A layout is where every light is, in the order the strands are wired.
+# Coordinates are in cells, x to the right and y up from the bottom, and
+# every cell is cellSize units of the LightPosition grid.  Everything is
+# kept as arrays with one entry per light, so once a layout is loaded
+# nothing has to go through the lights one Python object at a time.
+#
+# Layout files are CSV or JSON:
+#
+#   CSV:   a header row naming the x and y columns, and optionally strand
+#          and index columns
+#   JSON:  {"cellSize": 50, "lights": [{"x": 0, "y": 19, "strand": 0}, ...]}
+#          or just the list of lights, and a light can be an [x, y] pair
+#
+# Lights are in strand order, then index order, then file order.  Without
+# a cellSize, the cells are as big as will fit the layout on the grid.
+LAYOUT_EXTENSIONS = [".csv", ".json"]
+
+class GridIndex:
+	# The lights bucketed by which square of side bucketSize they're in.
+	# lights holds the light indexes sorted by bucket, row by row, and
+	# bucketStarts says where each bucket's lights start in it, so a row of
+	# buckets is one slice and a query only ever looks at nearby lights.
+	def __init__(self, x, y, bucketSize=None):
+		self.x = numpy.asarray(x, dtype=float)
+		self.y = numpy.asarray(y, dtype=float)
+		self.left = self.x.min()
+		self.bottom = self.y.min()
+
+		if bucketSize is None:
+			# A light or two in each bucket, on average
+			span = max(self.x.max() - self.left, self.y.max() - self.bottom, 1)
+			bucketSize = span / int(math.sqrt(len(self.x)))
+		self.bucketSize = float(bucketSize)
+
+		columns = self._Column(self.x)
+		rows = self._Row(self.y)
+		self.columns = int(columns.max()) + 1
+		self.rows = int(rows.max()) + 1
+
+		buckets = rows * self.columns + columns
+		self.lights = numpy.argsort(buckets, kind="mergesort")
+		self.bucketStarts = numpy.searchsorted(
+			buckets[self.lights], numpy.arange(self.rows * self.columns + 1))
+
+	def _Column(self, x):
+		return numpy.floor((numpy.asarray(x) - self.left) / self.bucketSize).astype(numpy.intp)
+
+	def _Row(self, y):
+		return numpy.floor((numpy.asarray(y) - self.bottom) / self.bucketSize).astype(numpy.intp)
+
+	def InRect(self, left, bottom, right, top):
+		# The lights with left <= x <= right and bottom <= y <= top, in order
+		firstColumn = max(int(self._Column(left)), 0)
+		lastColumn = min(int(self._Column(right)), self.columns - 1)
+		firstRow = max(int(self._Row(bottom)), 0)
+		lastRow = min(int(self._Row(top)), self.rows - 1)
+		if firstColumn > lastColumn or firstRow > lastRow:
+			return numpy.zeros(0, dtype=numpy.intp)
+
+		candidates = numpy.concatenate([
+			self.lights[self.bucketStarts[row * self.columns + firstColumn]:
+				self.bucketStarts[row * self.columns + lastColumn + 1]]
+			for row in range(firstRow, lastRow + 1)])
+		x = self.x[candidates]
+		y = self.y[candidates]
+		inside = (x >= left) & (x <= right) & (y >= bottom) & (y <= top)
+		return numpy.sort(candidates[inside])
+
+	def Near(self, x, y, radius):
+		# The lights within radius of (x, y), in order
+		candidates = self.InRect(x - radius, y - radius, x + radius, y + radius)
+		distances = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+		return candidates[distances <= radius]
+
+	def Nearest(self, x, y):
+		# The light closest to (x, y).  I look in ever bigger squares until
+		# one has a light in it; something closer could still be just
+		# outside that square, so I check the circle that reaches it too.
+		radius = self.bucketSize
+		while True:
+			candidates = self.InRect(x - radius, y - radius, x + radius, y + radius)
+			if len(candidates):
+				break
+			radius *= 2
+		distances = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+		candidates = self.Near(x, y, distances.min() * (1 + 1e-9))
+		distances = numpy.hypot(self.x[candidates] - x, self.y[candidates] - y)
+		return int(candidates[numpy.argmin(distances)])
+
+class LightLayout:
+	def __init__(self, x, y, cellSize=None, strands=None, indexes=None):
+		x = numpy.asarray(x)
+		y = numpy.asarray(y)
+		if x.shape != y.shape or x.ndim != 1 or not len(x):
+			raise ValueError("A layout needs one x and one y for each of at least one light")
+		if (x < 0).any() or (y < 0).any():
+			raise ValueError("Layout coordinates can't be negative")
+
+		if strands is None:
+			strands = numpy.zeros(len(x), dtype=int)
+		if indexes is None:
+			indexes = numpy.zeros(len(x), dtype=int)
+		strands = numpy.asarray(strands)
+		order = numpy.lexsort((numpy.arange(len(x)), numpy.asarray(indexes), strands))
+
+		# Whole number layouts stay integers, so they print and hash the
+		# same as they always have
+		coords = numpy.stack([x[order], y[order]], axis=-1).astype(float)
+		if (coords == numpy.round(coords)).all():
+			coords = coords.astype(int)
+		self.coords = coords
+		self.coords.setflags(write=False)
+		self.x = coords[:, 0]
+		self.y = coords[:, 1]
+		self.strands = strands[order]
+		self.lightCount = len(coords)
+
+		# Every light's whole cell has to be on the grid, or its pixels
+		# would be off the edge of the frame
+		cellsAcross = float(coords.max()) + 1
+		if cellSize is None:
+			cellSize = max(1, LightPosition.POSITION_GRID_WIDTH // int(math.ceil(cellsAcross)))
+		elif cellSize <= 0:
+			raise ValueError("Layout cells have to be bigger than 0, not %s" % cellSize)
+		if (cellsAcross * cellSize > LightPosition.POSITION_GRID_WIDTH or
+				cellsAcross * cellSize > LightPosition.POSITION_GRID_HEIGHT):
+			raise ValueError("A layout %s cells across with %s unit cells doesn't fit on the %dx%d grid" % (
+				cellsAcross, cellSize, LightPosition.POSITION_GRID_WIDTH,
+				LightPosition.POSITION_GRID_HEIGHT))
+		self.cellSize = cellSize
+
+		# Every light's cell center on the LightPosition grid
+		# NOTE: y is numbered from bottom to top, but the grid starts at the top
+		self.positionX = self.x * cellSize + cellSize / 2.0
+		self.positionY = LightPosition.POSITION_GRID_HEIGHT - (self.y * cellSize + cellSize / 2.0)
+
+		self.grid = GridIndex(self.x, self.y)
+
+	def RelativePixels(self, frameWidth, frameHeight):
+		# Every light's center pixel in a frame of this size.  Halves round
+		# up, as LightPosition.GetRelativeX's round() did on Python 2, where
+		# every render so far came from; Python 3 would round them to even.
+		pixelX = numpy.floor(self.positionX * (frameWidth / float(LightPosition.POSITION_GRID_WIDTH)) + 0.5)
+		pixelY = numpy.floor(self.positionY * (frameHeight / float(LightPosition.POSITION_GRID_HEIGHT)) + 0.5)
+		return pixelX.astype(numpy.intp), pixelY.astype(numpy.intp)
+
+	def ToCsv(self):
+		lines = ["x,y,strand"]
+		for (x, y), strand in zip(self.coords.tolist(), self.strands.tolist()):
+			lines.append("%s,%s,%s" % (x, y, strand))
+		return "\n".join(lines) + "\n"
+
+def _ReadCsv(layoutFile):
+	rows = list(csv.reader(line for line in layoutFile if line.strip() and not line.startswith("#")))
+	if not rows:
+		raise ValueError("Layout file is empty")
+	header = [name.strip().lower() for name in rows[0]]
+	if "x" not in header or "y" not in header:
+		raise ValueError("Layout CSV needs a header naming its x and y columns")
+	columns = dict(zip(header, zip(*rows[1:])))
+	values = {}
+	for name, valueType in (("x", float), ("y", float), ("strand", int), ("index", int)):
+		if name in columns:
+			values[name] = numpy.array([valueType(float(value)) for value in columns[name]])
+	return values.get("x"), values.get("y"), None, values.get("strand"), values.get("index")
+
+def _ReadJson(layoutFile):
+	layout = json.load(layoutFile)
+	cellSize = None
+	if isinstance(layout, dict):
+		cellSize = layout.get("cellSize")
+		layout = layout.get("lights", [])
+	if layout and not isinstance(layout[0], dict):
+		layout = [{"x": light[0], "y": light[1]} for light in layout]
+	x = numpy.array([light["x"] for light in layout], dtype=float)
+	y = numpy.array([light["y"] for light in layout], dtype=float)
+	strands = numpy.array([light.get("strand", 0) for light in layout])
+	indexes = numpy.array([light.get("index", 0) for light in layout])
+	return x, y, cellSize, strands, indexes
+
+# Layouts already loaded in this process, by path, size and time modified
+_layouts = {}
+
+def LoadLayout(path):
+	stat = os.stat(path)
+	key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+	if key not in _layouts:
+		extension = os.path.splitext(path)[1].lower()
+		if extension not in LAYOUT_EXTENSIONS:
+			raise ValueError("Layout files are %s, not %s" % (" or ".join(LAYOUT_EXTENSIONS), path))
+		with open(path) as layoutFile:
+			if extension == ".json":
+				x, y, cellSize, strands, indexes = _ReadJson(layoutFile)
+			else:
+				x, y, cellSize, strands, indexes = _ReadCsv(layoutFile)
+		_layouts[key] = LightLayout(x, y, cellSize, strands, indexes)
+	return _layouts[key]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description='Check a light layout, or write the current one out as CSV to start a new one from')
+	parser.add_argument('layout', nargs='?', default=None,
+		help='The layout file to check (by default, write out the current layout)')
+	args = parser.parse_args()
+
+	if args.layout is None:
+		from constants import LAYOUT
+		sys.stdout.write(LAYOUT.ToCsv())
+	else:
+		layout = LoadLayout(args.layout)
+		print("%d lights on %d strands, %s to %s by %s to %s, %s units a cell" % (
+			layout.lightCount, len(numpy.unique(layout.strands)),
+			layout.x.min(), layout.x.max(), layout.y.min(), layout.y.max(), layout.cellSize))
+
+# vim: set ts=8 sw=8 noet:
@@ -1,94 +1,585 @@
 #!/usr/bin/env python
-import os, subprocess, math, glob
+import os, sys, subprocess, math, glob, shlex, argparse, collections, multiprocessing
+import numpy
 from LightPosition import LightPosition
-from constants import CARTESIAN_COORDS as COORDS
+from LightSampler import PointSampler, AreaSampler
+from RenderCache import RenderCache
+from FrameWriter import FrameWriter
+from RenderContainer import ContainerWriter, COMPRESSIONS, CONTAINER_EXTENSION
+from RenderMetrics import RenderMetrics, monotonic
+from FrameDecoder import FRAME_DECODERS, FFmpegDecoder, BuildFilterGraph, DefaultDecoderName
+from LiveSource import LiveSource
+from frame_sink import FrameSink
+from constants import LAYOUT, FPS
 from PIL import Image
 
-FPS = 20
 RESOURCES_PATH = "Resources"
 FRAMES_TEMP_PATH = "%s/Frames" % RESOURCES_PATH
 VIDEO_SOURCE_FILE = "video.mp4"
 RENDER_OUTPUT_FILE = "video.bin"
+RENDER_CONTAINER_FILE = "video" + CONTAINER_EXTENSION
+PROBE_CACHE_PATH = "%s/probe-cache.json" % RESOURCES_PATH
+RENDER_CACHE_PATH = "%s/RenderCache" % RESOURCES_PATH
 
-# Lights are on a fixed grid, so we can compute their theoretical positions
-# NOTE: ROWS is numbered from bottom to top, but PIL starts in the top left.
-LIGHT_POSITIONS = [LightPosition(c*50+25, 1000-(r*50+25)) for c, r in COORDS]
-
-# Cleanup at start, so I can leave my temp files at the end for debugging
-print("Clearing frames temp folder")
-for tempFilePath in glob.glob("%s/*" % FRAMES_TEMP_PATH):
-	if os.path.isfile(tempFilePath):
-		os.unlink(tempFilePath)
-
-# Query the video properties I need to know
-print("Getting video duration")
-cmd = [
-	"ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", 
-	"default=noprint_wrappers=1:nokey=1", "%s/%s" % (RESOURCES_PATH, VIDEO_SOURCE_FILE)]
-ffProbeSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-ffProbeOutput, ffProbeError = ffProbeSubprocess.communicate()
-videoDuration = float(ffProbeOutput)
-print("Video duration is %fs" % videoDuration)
-
-cmd = [
-	"ffprobe", "-v", "error", "-show_entries", "stream=width", "-of", 
-	"default=noprint_wrappers=1:nokey=1", "%s/%s" % (RESOURCES_PATH, VIDEO_SOURCE_FILE)]
-ffProbeSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-ffProbeOutput, ffProbeError = ffProbeSubprocess.communicate()
-videoWidth = int(ffProbeOutput)
-print("Video width is %dpx" % videoWidth)
-
-cmd = [
-	"ffprobe", "-v", "error", "-show_entries", "stream=height", "-of", 
-	"default=noprint_wrappers=1:nokey=1", "%s/%s" % (RESOURCES_PATH, VIDEO_SOURCE_FILE)]
-ffProbeSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-ffProbeOutput, ffProbeError = ffProbeSubprocess.communicate()
-videoHeight = int(ffProbeOutput)
-print("Video height is %dpx" % videoHeight)
-
-# Extract image files to represent each frame in my rendering
-print("Extracting frame images")
-cmd = [
-	"ffmpeg", "-i", "%s/%s" % (RESOURCES_PATH, VIDEO_SOURCE_FILE), "-vf", "fps=%d" % FPS, 
-	"%s/frame%%06d.png" % FRAMES_TEMP_PATH]
-ffMpegSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-ffMpegOutput, ffMpegError = ffMpegSubprocess.communicate()
-print("Frame images extracted")
-
-# Extract color for each light from my images
-numberOfFrameImages = int(math.floor((videoDuration * FPS)))
-print("Extracting pixel data from %d frame images" % numberOfFrameImages)
-
-lightRenderData = []
-
-for frameNumber in xrange(1, numberOfFrameImages + 1):
-	frameImage = Image.open("%s/frame%06d.png" % (FRAMES_TEMP_PATH, frameNumber))
-	framePixels = frameImage.load()
-
-	for lightIndex, lightPosition in enumerate(LIGHT_POSITIONS, 1):
-		lightPixel = framePixels[
-			lightPosition.GetRelativeX(videoWidth), lightPosition.GetRelativeY(videoHeight)]
-
-		lightR = int(lightPixel[0])
-		lightG = int(lightPixel[1])
-		lightB = int(lightPixel[2])
-
-		if __debug__:
-			print(
-				"Frame %d/%d, Light %d/%d is (%d, %d, %d)" % (
-					frameNumber, numberOfFrameImages, lightIndex,
-					len(LIGHT_POSITIONS), lightR, lightG, lightB))
-
-		lightRenderData.append(lightR)
-		lightRenderData.append(lightG)
-		lightRenderData.append(lightB)
-
-print("Generated render binary of %d bytes" % len(lightRenderData))
-
-# Output the rendering to a file
-print("Storing to binary stream file")
-with open("%s/%s" % (RESOURCES_PATH, RENDER_OUTPUT_FILE), "wb") as outputFile:
-	outputFile.write(bytearray(lightRenderData))
-print("Stored rendering to %s" % RENDER_OUTPUT_FILE)
+# Frames are handled as packed rgb24, whether they come from a pipe, PyAV or a PNG
+BYTES_PER_PIXEL = 3
+
+# Each light owns a square cell of the LightPosition grid
+LIGHT_CELL_SIZE = LAYOUT.cellSize
+
+# Scaler algorithms ffmpeg can use to reduce each light's cell to one pixel
+FFMPEG_SCALE_FLAGS = ["area", "neighbor", "bilinear", "bicubic"]
+
+# How many of the slowest calls --profile prints
+PROFILE_PRINT_LINES = 25
+
+# Rendered frames are cached a minute at a time
+RENDER_CACHE_CHUNK_FRAMES = 60 * FPS
+RENDER_CACHE_DEFAULT_MB = 1024
+
+# Live sources are scaled to this before sampling, unless --scale-in-ffmpeg
+# scales them down to the lights themselves
+LIVE_FRAME_SIZE = "640x360"
+
+# Latency percentiles cover this many of the most recent live frames
+LIVE_LATENCY_WINDOW_FRAMES = 60 * FPS
+
+def ProbeVideo(decoder):
+	# Query the video properties I need to know
+	print("Probing video")
+	videoInfo = decoder.Probe(PROBE_CACHE_PATH)
+	print("Video duration is %fs" % videoInfo["duration"])
+	print("Video width is %dpx" % videoInfo["width"])
+	print("Video height is %dpx" % videoInfo["height"])
+	if videoInfo["frameRate"]:
+		print("Video frame rate is %.3ffps, %s frames" % (
+			videoInfo["frameRate"], videoInfo["frameCount"]))
+
+	return videoInfo["duration"], videoInfo["width"], videoInfo["height"]
+
+def BuildCellFilter(scaleFlags):
+	# Crop the video to the cells that actually hold lights, then let ffmpeg
+	# scale each cell down to a single pixel.  Only a few hundred bytes per
+	# frame ever reach Python, however big the source is.
+	# Fractional coordinates are in the cell they're inside, as the
+	# samplers see them
+	columns = numpy.floor(LAYOUT.x).astype(int)
+	rows = numpy.floor(LAYOUT.y).astype(int)
+	firstColumn, lastColumn = int(columns.min()), int(columns.max())
+	firstRow, lastRow = int(rows.min()), int(rows.max())
+	cellColumns = lastColumn - firstColumn + 1
+	cellRows = lastRow - firstRow + 1
+
+	# The crop is worked out in LightPosition grid units rather than in
+	# cells, since the cells don't have to divide the grid evenly
+	gridWidth = LightPosition.POSITION_GRID_WIDTH
+	gridHeight = LightPosition.POSITION_GRID_HEIGHT
+	cropLeft = firstColumn * LIGHT_CELL_SIZE
+	cropWidth = cellColumns * LIGHT_CELL_SIZE
+	# NOTE: rows are numbered from bottom to top, but the crop is from the top
+	cropTop = gridHeight - (lastRow + 1) * LIGHT_CELL_SIZE
+	cropHeight = cellRows * LIGHT_CELL_SIZE
+
+	# Convert to rgb24 first, so cells are sampled the same way the full
+	# frames would be rather than from subsampled chroma
+	filters = ["format=rgb24"]
+	if (cropLeft, cropTop, cropWidth, cropHeight) != (0, 0, gridWidth, gridHeight):
+		filters.append("crop=w=iw*%s/%d:h=ih*%s/%d:x=iw*%s/%d:y=ih*%s/%d" % (
+			cropWidth, gridWidth, cropHeight, gridHeight,
+			cropLeft, gridWidth, cropTop, gridHeight))
+	filters.append("scale=%d:%d:flags=%s" % (cellColumns, cellRows, scaleFlags))
+
+	# Where each light's pixel lands in the scaled down frame
+	lightPixels = numpy.stack([columns - firstColumn, lastRow - rows], axis=-1)
+
+	return ",".join(filters), cellColumns, cellRows, lightPixels
+
+def ExtractFrameImages(sourcePath, cellFilter, numberOfFrames):
+	# Cleanup at start, so I can leave my temp files at the end for debugging
+	print("Clearing frames temp folder")
+	for tempFilePath in glob.glob("%s/*" % FRAMES_TEMP_PATH):
+		if os.path.isfile(tempFilePath):
+			os.unlink(tempFilePath)
+
+	# Extract image files to represent each frame in my rendering
+	print("Extracting frame images")
+	cmd = [
+		"ffmpeg", "-i", sourcePath, "-vf", BuildFilterGraph(FPS, cellFilter),
+		"%s/frame%%06d.png" % FRAMES_TEMP_PATH]
+	ffMpegSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+	ffMpegOutput, ffMpegError = ffMpegSubprocess.communicate()
+	print("Frame images extracted")
+
+	for frameNumber in range(1, numberOfFrames + 1):
+		frameImage = Image.open("%s/frame%06d.png" % (FRAMES_TEMP_PATH, frameNumber))
+		yield frameImage.convert("RGB").tobytes()
+
+def SampleFrames(frames, sampler, frameOutputs, metrics=None):
+	# Sample each frame into the next of frameOutputs, and return how many
+	# frames there were and how long was spent waiting for them, sampling
+	# them and handing them to the writer.  Nothing in here prints; metrics
+	# hear about progress every FPS frames and decide for themselves.
+	frameCount = 0
+	decodeSeconds = sampleSeconds = writeSeconds = 0.0
+	started = monotonic()
+	for frameBuffer in frames:
+		decoded = monotonic()
+		frameOutput = next(frameOutputs)
+		slotted = monotonic()
+		sampler.Sample(frameBuffer, out=frameOutput)
+		sampled = monotonic()
+
+		decodeSeconds += decoded - started
+		writeSeconds += slotted - decoded
+		sampleSeconds += sampled - slotted
+		started = sampled
+
+		frameCount += 1
+		if metrics and frameCount % FPS == 0:
+			metrics.FramesDone(FPS)
+	decodeSeconds += monotonic() - started
+
+	stageSeconds = {"decode": decodeSeconds, "sample": sampleSeconds, "write": writeSeconds}
+	if metrics:
+		metrics.AddStageSeconds(stageSeconds)
+		metrics.FramesDone(frameCount % FPS)
+	return frameCount, stageSeconds
+
+# Each worker process gets the sampler once, rather than with every segment
+_segmentSampler = None
+
+def _InitSegmentWorker(sampler):
+	global _segmentSampler
+	_segmentSampler = sampler
+
+def RenderSegment(segment):
+	sourcePath, decoderName, decoderThreads, cellFilter, frameSize, firstFrame, segmentFrames = segment
+	segmentData = numpy.empty(
+		(segmentFrames, _segmentSampler.lightCount, BYTES_PER_PIXEL), dtype=numpy.uint8)
+	decoder = FRAME_DECODERS[decoderName](sourcePath, FPS, decoderThreads)
+	frames = decoder.Frames(frameSize, segmentFrames, firstFrame, cellFilter)
+	frameCount, stageSeconds = SampleFrames(frames, _segmentSampler, iter(segmentData))
+	return firstFrame, segmentData[:frameCount], stageSeconds
+
+def PlanSegments(frameRuns, jobs, maxSegmentFrames):
+	# Cut the (firstFrame, frameCount) runs that need rendering into
+	# segments, enough of them to keep every job busy but none so long that
+	# holding one in memory matters
+	totalFrames = sum(frameCount for firstFrame, frameCount in frameRuns)
+	segmentFrames = min(maxSegmentFrames, max(1, -(-totalFrames // jobs)))
+
+	segments = []
+	for firstFrame, frameCount in frameRuns:
+		for segmentStart in range(firstFrame, firstFrame + frameCount, segmentFrames):
+			segments.append((
+				segmentStart, min(segmentFrames, firstFrame + frameCount - segmentStart)))
+	return segments
+
+def SamplingMode(scaleFlags, areaKernel):
+	# A name for how lights are sampled, for telling renders apart
+	if scaleFlags:
+		return "ffmpeg-%s" % scaleFlags
+	if areaKernel:
+		return "area-%s" % areaKernel
+	return "point"
+
+def Render(keepFrameImages=False, scaleFlags=None, areaKernel=None, jobs=1, cacheBytes=None,
+		compression=None, metrics=None, decoderName=None, decoderThreads=0):
+	# metrics collects how long each stage took; pass in your own to keep
+	# them, or to hook into progress reports
+	if metrics is None:
+		metrics = RenderMetrics()
+
+	# Only the ffmpeg command line can run filters or write PNGs
+	if decoderName is None:
+		decoderName = FFmpegDecoder.name if scaleFlags or keepFrameImages else DefaultDecoderName()
+	print("Decoding with %s" % decoderName)
+
+	sourcePath = "%s/%s" % (RESOURCES_PATH, VIDEO_SOURCE_FILE)
+	decoder = FRAME_DECODERS[decoderName](sourcePath, FPS, decoderThreads)
+	with metrics.Stage("probe"):
+		videoDuration, videoWidth, videoHeight = ProbeVideo(decoder)
+
+	numberOfFrames = int(math.floor((videoDuration * FPS)))
+	metrics.totalFrames = numberOfFrames
+	metrics.info.update({
+		"videoWidth": videoWidth, "videoHeight": videoHeight, "lights": LAYOUT.lightCount,
+		"fps": FPS, "sampling": SamplingMode(scaleFlags, areaKernel), "jobs": jobs,
+		"decoder": decoderName,
+	})
+
+	if scaleFlags:
+		cellFilter, frameWidth, frameHeight, lightPixels = BuildCellFilter(scaleFlags)
+		print("Sampling lights in ffmpeg with %s" % cellFilter)
+		sampler = PointSampler(lightPixels, frameWidth, frameHeight)
+	else:
+		cellFilter = None
+		frameWidth, frameHeight = videoWidth, videoHeight
+		if areaKernel:
+			print("Averaging each light's cell with %s weights" % areaKernel)
+			sampler = AreaSampler.FromLayout(LAYOUT, frameWidth, frameHeight, areaKernel)
+		else:
+			sampler = PointSampler.FromLayout(LAYOUT, frameWidth, frameHeight)
+
+	frameSize = frameWidth * frameHeight * BYTES_PER_PIXEL
+	lightFrameBytes = LAYOUT.lightCount * BYTES_PER_PIXEL
+
+	# Everything is rendered, cached and written a chunk at a time
+	chunks = [
+		(chunkStart, min(RENDER_CACHE_CHUNK_FRAMES, numberOfFrames - chunkStart))
+		for chunkStart in range(0, numberOfFrames, RENDER_CACHE_CHUNK_FRAMES)]
+
+	# Chunks of frames already rendered with exactly these settings
+	renderCache = None
+	cachedChunks = set()
+	if cacheBytes and not keepFrameImages:
+		renderCache = RenderCache(RENDER_CACHE_PATH, cacheBytes)
+		renderKey = renderCache.RenderKey(sourcePath, {
+			"layout": LAYOUT.coords.tolist(),
+			"cellSize": LIGHT_CELL_SIZE,
+			"fps": FPS,
+			"sampling": SamplingMode(scaleFlags, areaKernel),
+		})
+		with metrics.Stage("cache"):
+			cachedChunks = set(
+				chunkStart for chunkStart, chunkFrames in chunks
+				if renderCache.Has(renderKey, chunkStart, chunkFrames, chunkFrames * lightFrameBytes))
+		print("Found %d of %d chunks in the render cache" % (len(cachedChunks), len(chunks)))
+
+	def StoreChunk(chunkStart, chunkData):
+		# Called by the writer as each chunk is finished
+		chunkFrames = min(RENDER_CACHE_CHUNK_FRAMES, numberOfFrames - chunkStart)
+		if renderCache and chunkStart not in cachedChunks and len(chunkData) == chunkFrames:
+			renderCache.Put(renderKey, chunkStart, chunkFrames, chunkData.tobytes())
+
+	# The order to produce the video in: chunks to copy from the cache, and
+	# runs of frames to render
+	plan = []
+	for chunkStart, chunkFrames in chunks:
+		if chunkStart in cachedChunks:
+			plan.append(["cache", chunkStart, chunkFrames])
+		elif plan and plan[-1][0] == "render" and plan[-1][1] + plan[-1][2] == chunkStart:
+			plan[-1][2] += chunkFrames
+		else:
+			plan.append(["render", chunkStart, chunkFrames])
+
+	# Extract color for each light from my frames
+	print("Extracting pixel data from %d frames" % sum(
+		frameCount for source, firstFrame, frameCount in plan if source == "render"))
+
+	pool = None
+	if keepFrameImages:
+		plan = [["images", 0, numberOfFrames]]
+	elif jobs > 1 and any(source == "render" for source, firstFrame, frameCount in plan):
+		# Workers render segments in parallel, and the results come back in
+		# order to be written out
+		segments = PlanSegments(
+			[(firstFrame, frameCount) for source, firstFrame, frameCount in plan if source == "render"],
+			jobs, RENDER_CACHE_CHUNK_FRAMES)
+		plan = sorted(
+			[step for step in plan if step[0] == "cache"] +
+			[["segment", firstFrame, frameCount] for firstFrame, frameCount in segments],
+			key=lambda step: step[1])
+
+		print("Rendering %d segments with %d processes" % (len(segments), jobs))
+		pool = multiprocessing.Pool(jobs, _InitSegmentWorker, (sampler,))
+		renderedSegments = pool.imap(RenderSegment, [
+			(sourcePath, decoderName, decoderThreads, cellFilter, frameSize, firstFrame, frameCount)
+			for firstFrame, frameCount in segments])
+
+	if compression:
+		outputFileName = RENDER_CONTAINER_FILE
+		writer = ContainerWriter(
+			"%s/%s" % (RESOURCES_PATH, outputFileName),
+			(LAYOUT.lightCount, BYTES_PER_PIXEL), RENDER_CACHE_CHUNK_FRAMES, StoreChunk,
+			fps=FPS, compression=compression)
+	else:
+		outputFileName = RENDER_OUTPUT_FILE
+		writer = FrameWriter(
+			"%s/%s" % (RESOURCES_PATH, outputFileName),
+			(LAYOUT.lightCount, BYTES_PER_PIXEL), RENDER_CACHE_CHUNK_FRAMES, StoreChunk)
+	try:
+		for source, firstFrame, frameCount in plan:
+			if writer.frameNumber != firstFrame:
+				# Something came up short, so nothing after it would line up
+				break
+
+			if source == "cache":
+				with metrics.Stage("cache"):
+					chunkData = renderCache.Get(
+						renderKey, firstFrame, frameCount, frameCount * lightFrameBytes)
+				if chunkData is not None:
+					with metrics.Stage("write"):
+						writer.WriteFrames(numpy.frombuffer(chunkData, dtype=numpy.uint8))
+					metrics.FramesDone(frameCount)
+					continue
+				# It was evicted since I looked, so render it after all
+				cachedChunks.discard(firstFrame)
+
+			if source == "segment":
+				with metrics.Stage("wait"):
+					segmentStart, segmentData, stageSeconds = next(renderedSegments)
+				metrics.AddStageSeconds(stageSeconds)
+				with metrics.Stage("write"):
+					writer.WriteFrames(segmentData)
+				metrics.FramesDone(len(segmentData))
+			elif source == "images":
+				frames = ExtractFrameImages(sourcePath, cellFilter, frameCount)
+				SampleFrames(frames, sampler, writer.FrameSlots(), metrics)
+			else:
+				frames = decoder.Frames(frameSize, frameCount, firstFrame, cellFilter)
+				SampleFrames(frames, sampler, writer.FrameSlots(), metrics)
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
+		with metrics.Stage("write"):
+			writer.Close()
+		metrics.Finish()
+
+	frameNumber = writer.framesWritten
+	if frameNumber < numberOfFrames:
+		print("Warning: expected %d frames but only got %d" % (numberOfFrames, frameNumber))
+
+	print("Generated render binary of %d bytes" % (frameNumber * lightFrameBytes))
+	print("Stored rendering to %s" % outputFileName)
+	print(metrics.Report())
+
+def ParseFrameSize(text):
+	try:
+		width, height = [int(size) for size in text.lower().split("x")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("%r isn't WIDTHxHEIGHT" % text)
+	return width, height
+
+def Log(message):
+	# Live light frames go to stdout, so everything I have to say goes
+	# to stderr
+	sys.stderr.write(message + "\n")
+	sys.stderr.flush()
+
+def RenderLive(source, inputFormat=None, inputOptions=(), frameWidth=640, frameHeight=360,
+		scaleFlags=None, areaKernel=None, output=None, queueFrames=1, metrics=None):
+	# Sample each frame of a live source as it arrives and send its lights
+	# out right away.  Nothing waits on anything slower than it: frames the
+	# sampler can't get to are dropped from LiveSource's queue, and light
+	# frames the reader has no room for are dropped by the sink, as in
+	# pattern_engine's --realtime.  Latency is counted from when a frame
+	# came off ffmpeg's pipe to when its lights were sent.
+	if metrics is None:
+		metrics = RenderMetrics(output=sys.stderr)
+
+	if scaleFlags:
+		cellFilter, frameWidth, frameHeight, lightPixels = BuildCellFilter(scaleFlags)
+		Log("Sampling lights in ffmpeg with %s" % cellFilter)
+		sampler = PointSampler(lightPixels, frameWidth, frameHeight)
+	else:
+		cellFilter = "scale=%d:%d" % (frameWidth, frameHeight)
+		if areaKernel:
+			Log("Averaging each light's cell with %s weights" % areaKernel)
+			sampler = AreaSampler.FromLayout(LAYOUT, frameWidth, frameHeight, areaKernel)
+		else:
+			sampler = PointSampler.FromLayout(LAYOUT, frameWidth, frameHeight)
+	metrics.info.update({
+		"source": source, "videoWidth": frameWidth, "videoHeight": frameHeight,
+		"lights": LAYOUT.lightCount, "fps": FPS, "sampling": SamplingMode(scaleFlags, areaKernel),
+		"queueFrames": queueFrames,
+	})
+
+	# A file or a test source would be read as fast as ffmpeg can go, so
+	# it's slowed to its own frame rate to stand in for a live one
+	realtime = inputFormat == "lavfi" or os.path.isfile(source)
+	liveSource = LiveSource(source, inputFormat, FPS, frameWidth * frameHeight * BYTES_PER_PIXEL,
+		cellFilter, realtime, inputOptions, queueFrames)
+	sink = FrameSink(output, nonblocking=True, pipe_bytes=LAYOUT.lightCount * BYTES_PER_PIXEL)
+
+	framePeriod = 1.0 / FPS
+	latencies = collections.deque(maxlen=LIVE_LATENCY_WINDOW_FRAMES)
+	maxLatency = 0.0
+	sent = refused = slowFrames = 0
+	lightFrame = numpy.empty((LAYOUT.lightCount, BYTES_PER_PIXEL), dtype=numpy.uint8)
+
+	Log("Sampling %s live at %dfps" % (source, FPS))
+	liveSource.Start()
+	try:
+		waited = monotonic()
+		for arrived, frameBuffer in liveSource.Frames():
+			started = monotonic()
+			sampler.Sample(frameBuffer, out=lightFrame)
+			sampled = monotonic()
+			if sink.offer(lightFrame):
+				sent += 1
+			else:
+				refused += 1
+			done = monotonic()
+
+			metrics.stageSeconds["decode"] += started - waited
+			metrics.stageSeconds["sample"] += sampled - started
+			metrics.stageSeconds["write"] += done - sampled
+			waited = done
+
+			latency = done - arrived
+			latencies.append(latency)
+			maxLatency = max(maxLatency, latency)
+			if latency > framePeriod:
+				slowFrames += 1
+			metrics.FramesDone(1)
+			if sink.closed:
+				# Nobody's reading any more
+				break
+	except KeyboardInterrupt:
+		pass
+	finally:
+		try:
+			liveSource.Stop()
+		finally:
+			sink.close()
+			metrics.Finish()
+
+	metrics.info.update({
+		"framesRead": liveSource.framesRead, "framesSent": sent,
+		"droppedBehind": liveSource.queue.dropped, "droppedReaderFull": refused,
+		"latencyOverFramePeriod": slowFrames, "maxLatencyMs": 1000 * maxLatency,
+	})
+	Log("%d frames read, %d sent, %d dropped falling behind, "
+		"%d dropped because the reader was full" % (
+			liveSource.framesRead, sent, liveSource.queue.dropped, refused))
+	if latencies:
+		latencyMs = numpy.array(latencies) * 1000
+		metrics.info.update({
+			"meanLatencyMs": float(latencyMs.mean()),
+			"p95LatencyMs": float(numpy.percentile(latencyMs, 95)),
+		})
+		Log("latency: mean %.2fms, 95%% %.2fms, max %.2fms, %d frames over %.0fms" % (
+			latencyMs.mean(), numpy.percentile(latencyMs, 95), 1000 * maxLatency,
+			slowFrames, 1000 * framePeriod))
+	Log(metrics.Report())
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Render a video into light data')
+	parser.add_argument('-k', '--keep-frames', dest='keep_frames',
+			action='store_true', default=False,
+			help='Extract PNG frames to %s instead of streaming them, '
+			'and leave them there for debugging' % FRAMES_TEMP_PATH)
+
+	parser.add_argument('-s', '--scale-in-ffmpeg', dest='scale_flags',
+			choices=FFMPEG_SCALE_FLAGS, default=None,
+			help='Have ffmpeg scale each light\'s cell down to one pixel '
+			'with this algorithm, instead of reading full frames')
+
+	parser.add_argument('-a', '--area', dest='area_kernel',
+			choices=AreaSampler.KERNELS, default=None,
+			help='Average the pixels under each light\'s cell with these '
+			'weights, instead of reading the single pixel at its center')
+
+	parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+			help='Split the video into this many segments and render '
+			'them in parallel processes')
+
+	parser.add_argument('--cache-size', dest='cache_mb', type=int,
+			default=RENDER_CACHE_DEFAULT_MB,
+			help='Keep at most this many MB of rendered chunks in %s, '
+			'so re-rendering the same video with the same settings is '
+			'instant (default %%(default)s, 0 turns the cache off)' % RENDER_CACHE_PATH)
+
+	parser.add_argument('-c', '--container', dest='compression',
+			nargs='?', const='zlib', choices=sorted(COMPRESSIONS), default=None,
+			help='Write an indexed render container to %s instead of a raw '
+			'%s, with chunks compressed this way (default zlib)' % (
+				RENDER_CONTAINER_FILE, RENDER_OUTPUT_FILE))
+
+	parser.add_argument('--metrics', dest='metrics_path', default=None,
+			help='Write how long each stage of the render took, and the '
+			'settings, to this file as JSON')
+
+	parser.add_argument('--profile', dest='profile_path', default=None,
+			help='Run the render under cProfile, save the stats to this '
+			'file and print the slowest calls (only this process is '
+			'profiled, not --jobs workers)')
+
+	parser.add_argument('-d', '--decoder', dest='decoder', choices=sorted(FRAME_DECODERS),
+			default=None,
+			help='Decode the video in this process with PyAV, or with the '
+			'ffmpeg command line (default pyav when it\'s installed, and '
+			'always ffmpeg for --scale-in-ffmpeg and --keep-frames)')
+
+	parser.add_argument('--decoder-threads', dest='decoder_threads', type=int, default=0,
+			help='Threads for each decoder to use (default: let it choose)')
+
+	parser.add_argument('--live', dest='live', default=None, metavar='SOURCE',
+			help='Instead of rendering %s, sample this live source as it '
+			'comes in and write light frames to --live-output: anything '
+			'ffmpeg can read, e.g. /dev/video0 with --live-format v4l2, '
+			':0.0 with x11grab, udp://0.0.0.0:1234, or testsrc with lavfi' % VIDEO_SOURCE_FILE)
+
+	parser.add_argument('--live-format', dest='live_format', default=None,
+			help='ffmpeg input format of the --live source (v4l2, x11grab, lavfi, ...)')
+
+	parser.add_argument('--live-options', dest='live_options', type=shlex.split, default=[],
+			help='More ffmpeg input options for the --live source, '
+			'e.g. "-video_size 1280x720 -framerate 30"')
+
+	parser.add_argument('--live-size', dest='live_size', type=ParseFrameSize,
+			default=ParseFrameSize(LIVE_FRAME_SIZE),
+			help='Scale --live frames to WIDTHxHEIGHT before sampling '
+			'them (default %s)' % LIVE_FRAME_SIZE)
+
+	parser.add_argument('--live-output', dest='live_output', default=None,
+			help='Where --live light frames go (default stdout)')
+
+	parser.add_argument('--live-queue', dest='live_queue', type=int, default=1,
+			help='Most --live frames to hold for the sampler before '
+			'dropping the oldest (default %(default)s)')
+
+	args = parser.parse_args()
+
+	if args.jobs < 1:
+		parser.error("--jobs must be at least 1")
+	if args.cache_mb < 0:
+		parser.error("--cache-size can't be negative (0 turns the cache off)")
+	if args.jobs > 1 and args.keep_frames:
+		parser.error("--keep-frames can't be used with --jobs")
+
+	if args.decoder == "pyav" and (args.scale_flags or args.keep_frames):
+		parser.error("--scale-in-ffmpeg and --keep-frames need --decoder ffmpeg")
+
+	if args.scale_flags and args.area_kernel:
+		parser.error("--area can't be used with --scale-in-ffmpeg, "
+			"which already reduces each cell to one pixel")
+
+	if args.live:
+		if args.jobs > 1 or args.keep_frames or args.compression or args.decoder:
+			parser.error("--live reads through ffmpeg one frame at a time, so it can't be "
+				"used with --jobs, --keep-frames, --container or --decoder")
+		if args.live_queue < 1:
+			parser.error("--live-queue must be at least 1")
+		metrics = RenderMetrics(output=sys.stderr)
+		renderFunction = RenderLive
+		renderArgs = dict(source=args.live, inputFormat=args.live_format,
+			inputOptions=args.live_options, frameWidth=args.live_size[0],
+			frameHeight=args.live_size[1], scaleFlags=args.scale_flags,
+			areaKernel=args.area_kernel, output=args.live_output,
+			queueFrames=args.live_queue, metrics=metrics)
+	else:
+		metrics = RenderMetrics()
+		renderFunction = Render
+		renderArgs = dict(keepFrameImages=args.keep_frames, scaleFlags=args.scale_flags,
+			areaKernel=args.area_kernel, jobs=args.jobs, cacheBytes=args.cache_mb << 20,
+			compression=args.compression, metrics=metrics, decoderName=args.decoder,
+			decoderThreads=args.decoder_threads)
+	if args.profile_path:
+		import cProfile, pstats
+		profile = cProfile.Profile()
+		profile.runcall(renderFunction, **renderArgs)
+		profile.dump_stats(args.profile_path)
+		# Out of the way of --live frames on stdout
+		stream = sys.stderr if args.live else sys.stdout
+		pstats.Stats(args.profile_path, stream=stream).sort_stats("cumulative").print_stats(
+			PROFILE_PRINT_LINES)
+	else:
+		renderFunction(**renderArgs)
+
+	if args.metrics_path:
+		metrics.Dump(args.metrics_path)
 
 # vim: set ts=8 sw=8 noet:
@@ -0,0 +1,160 @@
+import math
+import numpy
+from LightPosition import LightPosition
+
+def FramePixels(frameBuffer):
+	# A frame's packed rgb24 bytes as a flat array, from bytes read off a
+	# pipe or a (height, width, 3) array straight from a decoder
+	if isinstance(frameBuffer, numpy.ndarray):
+		return numpy.ascontiguousarray(frameBuffer, dtype=numpy.uint8).reshape(-1)
+	return numpy.frombuffer(frameBuffer, dtype=numpy.uint8)
+
+class PointSampler:
+	BYTES_PER_PIXEL = 3
+
+	# lightPixels is a list or array of (x, y) pixel coordinates, one per
+	# light.  The pixel indexes are worked out once, so sampling a frame is a
+	# single gather.
+	def __init__(self, lightPixels, frameWidth, frameHeight):
+		self.frameWidth = frameWidth
+		self.frameHeight = frameHeight
+		self.lightCount = len(lightPixels)
+
+		lightPixels = numpy.asarray(lightPixels).reshape(-1, 2)
+		pixelX = lightPixels[:, 0].astype(numpy.intp)
+		pixelY = lightPixels[:, 1].astype(numpy.intp)
+		self.pixelIndexes = pixelY * frameWidth + pixelX
+
+	@classmethod
+	def FromLayout(cls, layout, frameWidth, frameHeight):
+		pixelX, pixelY = layout.RelativePixels(frameWidth, frameHeight)
+		return cls(numpy.stack([pixelX, pixelY], axis=-1), frameWidth, frameHeight)
+
+	def NewOutput(self):
+		return numpy.empty((self.lightCount, self.BYTES_PER_PIXEL), dtype=numpy.uint8)
+
+	# frameBuffer is a packed rgb24 frame.  The lights are written to out, one
+	# row of (r, g, b) per light, without copying the frame.
+	def Sample(self, frameBuffer, out=None):
+		if out is None:
+			out = self.NewOutput()
+		framePixels = FramePixels(frameBuffer).reshape(
+			-1, self.BYTES_PER_PIXEL)
+		numpy.take(framePixels, self.pixelIndexes, axis=0, out=out)
+		return out
+
+class AreaSampler:
+	BYTES_PER_PIXEL = 3
+	KERNELS = ["box", "gaussian"]
+
+	# A gaussian footprint falls off to about 13% at the edge of the cell
+	GAUSSIAN_SIGMAS_PER_CELL = 4.0
+
+	# Every light averages the pixels under its cellSize x cellSize square of
+	# the LightPosition grid, centered on (positionX, positionY).  Both
+	# kernels are separable, so each light gets a row of weights across and
+	# a column of weights down, worked out once per frame size.  All the
+	# windows are padded to the same size so a frame can be gathered and
+	# weighted for every light at once.
+	def __init__(self, positionX, positionY, cellSize, frameWidth, frameHeight, kernel="box"):
+		if kernel not in self.KERNELS:
+			raise ValueError("Unknown sampling kernel %r" % kernel)
+
+		self.frameWidth = frameWidth
+		self.frameHeight = frameHeight
+		self.lightCount = len(positionX)
+		self.kernel = kernel
+
+		scaleX = frameWidth / float(LightPosition.POSITION_GRID_WIDTH)
+		scaleY = frameHeight / float(LightPosition.POSITION_GRID_HEIGHT)
+
+		axesX = [
+			self._AxisWeights(x * scaleX, cellSize * scaleX, frameWidth)
+			for x in numpy.asarray(positionX).tolist()]
+		axesY = [
+			self._AxisWeights(y * scaleY, cellSize * scaleY, frameHeight)
+			for y in numpy.asarray(positionY).tolist()]
+
+		self.windowWidth = max(len(weights) for start, weights in axesX)
+		self.windowHeight = max(len(weights) for start, weights in axesY)
+
+		windowX, self.weightsX = self._PadWindows(axesX, self.windowWidth, frameWidth)
+		windowY, self.weightsY = self._PadWindows(axesY, self.windowHeight, frameHeight)
+
+		# Row and starting column of every line of every light's window
+		self.windowRows = windowY[:, None] + numpy.arange(self.windowHeight)
+		self.windowColumns = windowX[:, None]
+
+		# Scratch space, so sampling a frame doesn't allocate much
+		self._windows = numpy.empty(
+			(self.lightCount, self.windowHeight, self.windowWidth * self.BYTES_PER_PIXEL),
+			dtype=numpy.float32)
+
+	@classmethod
+	def FromLayout(cls, layout, frameWidth, frameHeight, kernel="box"):
+		return cls(layout.positionX, layout.positionY, layout.cellSize,
+			frameWidth, frameHeight, kernel)
+
+	def _AxisWeights(self, center, cellWidth, frameLength):
+		# The pixels along one axis that the cell touches, and how much each
+		# one counts.  Pixel i covers [i, i+1), so its center is at i + 0.5.
+		start = max(0, int(math.floor(center - cellWidth / 2.0)))
+		stop = min(frameLength, int(math.ceil(center + cellWidth / 2.0)))
+		stop = max(stop, start + 1)
+		pixels = numpy.arange(start, stop)
+
+		if self.kernel == "box":
+			# How much of each pixel is inside the cell
+			weights = (
+				numpy.minimum(pixels + 1, center + cellWidth / 2.0) -
+				numpy.maximum(pixels, center - cellWidth / 2.0))
+			weights = numpy.clip(weights, 0, 1)
+		else:
+			sigma = cellWidth / self.GAUSSIAN_SIGMAS_PER_CELL
+			weights = numpy.exp(-0.5 * ((pixels + 0.5 - center) / sigma) ** 2)
+
+		if not weights.sum():
+			weights = numpy.ones(len(pixels))
+		return start, weights / weights.sum()
+
+	def _PadWindows(self, axes, windowLength, frameLength):
+		# Slide windows that would run off the end of the frame back inside
+		# it, and leave zero weights wherever a window is wider than its cell
+		windowStarts = numpy.empty(len(axes), dtype=numpy.intp)
+		paddedWeights = numpy.zeros((len(axes), windowLength), dtype=numpy.float32)
+		for lightIndex, (start, weights) in enumerate(axes):
+			windowStart = min(start, frameLength - windowLength)
+			windowStarts[lightIndex] = windowStart
+			offset = start - windowStart
+			paddedWeights[lightIndex, offset:offset + len(weights)] = weights
+		return windowStarts, paddedWeights
+
+	def NewOutput(self):
+		return numpy.empty((self.lightCount, self.BYTES_PER_PIXEL), dtype=numpy.uint8)
+
+	# frameBuffer is a packed rgb24 frame.  The averaged lights are written to
+	# out, one row of (r, g, b) per light.
+	def Sample(self, frameBuffer, out=None):
+		if out is None:
+			out = self.NewOutput()
+		frameRows = FramePixels(frameBuffer).reshape(
+			self.frameHeight, self.frameWidth * self.BYTES_PER_PIXEL)
+
+		# A view of every window-wide run of pixels in the frame, so one fancy
+		# index copies whole lines of each light's window instead of pixels
+		lineLength = self.windowWidth * self.BYTES_PER_PIXEL
+		frameLines = numpy.lib.stride_tricks.as_strided(
+			frameRows,
+			shape=(self.frameHeight, self.frameWidth - self.windowWidth + 1, lineLength),
+			strides=(frameRows.strides[0], self.BYTES_PER_PIXEL, 1))
+		self._windows[...] = frameLines[self.windowRows, self.windowColumns]
+
+		# Weight down the rows, then across the columns
+		columnSums = numpy.matmul(self.weightsY[:, None, :], self._windows)
+		columnSums = columnSums.reshape(self.lightCount, self.windowWidth, self.BYTES_PER_PIXEL)
+		lightSums = numpy.matmul(self.weightsX[:, None, :], columnSums)[:, 0, :]
+
+		numpy.rint(lightSums, out=lightSums)
+		numpy.clip(lightSums, 0, 255, out=lightSums)
+		out[...] = lightSums
+		return out
@@ -0,0 +1,141 @@
+import os, subprocess, threading, collections
+from RenderMetrics import monotonic
+from FrameDecoder import BuildFilterGraph, FFmpegErrorLog, CheckFFmpegExit
+
+# A live source is anything ffmpeg can read as it happens: a capture device
+# (-f v4l2 /dev/video0), the screen (-f x11grab :0.0), a stream
+# (udp://0.0.0.0:1234), or a lavfi test source (-f lavfi testsrc) standing
+# in for a camera.  ffmpeg turns it into packed rgb24 frames at fps, and a
+# thread of mine reads them off the pipe the moment they're written, so
+# ffmpeg never waits on me.  Frames then wait for the sampler in a queue
+# that holds only the newest few; when the sampler falls behind, the
+# oldest frames are dropped instead of piling up into a backlog.
+
+# ffmpeg buffers input to work out what it's reading, and decoders hold
+# frames back to reorder or thread them.  All of that is latency here.
+LOW_DELAY_INPUT_FLAGS = [
+	"-flags", "low_delay", "-probesize", "32768", "-analyzeduration", "0"]
+
+# Real devices and streams skip ffmpeg's input buffer too.  A file or lavfi
+# source read with -re loses its opening frames to it, so they keep it.
+NO_BUFFER_INPUT_FLAGS = ["-fflags", "nobuffer"]
+
+# How long a wait for a frame sleeps at a time, so Ctrl-C still gets
+# through on Python 2, where waiting on a lock can't be interrupted
+WAIT_SLICE_SECONDS = 0.25
+
+class FrameQueue:
+	# Put never waits.  A full queue makes room by dropping its oldest
+	# frame, so what Get returns is never more than maxFrames frames old.
+	def __init__(self, maxFrames=1):
+		self.maxFrames = maxFrames
+		self.frames = collections.deque()
+		self.condition = threading.Condition()
+		self.closed = False
+		self.queued = 0
+		self.dropped = 0
+
+	def Put(self, frame):
+		with self.condition:
+			if len(self.frames) >= self.maxFrames:
+				self.frames.popleft()
+				self.dropped += 1
+			self.frames.append(frame)
+			self.queued += 1
+			self.condition.notify()
+
+	def Close(self):
+		# No more frames are coming; Get returns None once the rest are taken
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+
+	def Get(self):
+		with self.condition:
+			while not self.frames and not self.closed:
+				self.condition.wait(WAIT_SLICE_SECONDS)
+			if self.frames:
+				return self.frames.popleft()
+			return None
+
+class LiveSource:
+	def __init__(self, source, inputFormat=None, fps=20, frameSize=0, cellFilter=None,
+			realtime=False, inputOptions=(), queueFrames=1):
+		# frameSize is the bytes in each frame cellFilter leaves, and
+		# realtime reads a file or lavfi source at its own frame rate, the
+		# way a device would deliver it
+		self.frameSize = frameSize
+		self.queue = FrameQueue(queueFrames)
+		self.framesRead = 0
+
+		cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+		if realtime:
+			cmd.append("-re")
+		else:
+			cmd += NO_BUFFER_INPUT_FLAGS
+		cmd += LOW_DELAY_INPUT_FLAGS
+		if inputFormat:
+			cmd += ["-f", inputFormat]
+		cmd += list(inputOptions)
+		# Every frame is flushed down the pipe as soon as it's made, rather
+		# than whenever ffmpeg's output buffer fills
+		cmd += [
+			"-i", source, "-vf", BuildFilterGraph(fps, cellFilter), "-vsync", "passthrough",
+			"-flush_packets", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+		self.cmd = cmd
+		self.source = source
+		self.process = None
+		self.reader = None
+		self.errorLog = None
+
+	def Start(self):
+		# ffmpeg gets its own process group, so Ctrl-C only interrupts me
+		# and I stop ffmpeg myself, rather than it dying mid-frame first
+		self.errorLog = FFmpegErrorLog()
+		self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE,
+			stderr=self.errorLog, preexec_fn=getattr(os, "setpgrp", None))
+		self.reader = threading.Thread(target=self._Read)
+		self.reader.daemon = True
+		self.reader.start()
+
+	def _Read(self):
+		try:
+			while True:
+				frameBuffer = self.process.stdout.read(self.frameSize)
+				if len(frameBuffer) < self.frameSize:
+					break
+				self.framesRead += 1
+				self.queue.Put((monotonic(), frameBuffer))
+		finally:
+			self.queue.Close()
+
+	def Frames(self):
+		# (when it arrived, frame) for each frame, oldest still queued first,
+		# until the source ends
+		while True:
+			frame = self.queue.Get()
+			if frame is None:
+				return
+			yield frame
+
+	def Stop(self):
+		# Nothing ffmpeg would still write is wanted, and a live input can
+		# keep it going for a while after a polite SIGTERM.  If ffmpeg had
+		# already ended its output by itself, it has to have ended cleanly.
+		stoppedByItself = self.reader is not None and not self.reader.is_alive()
+		if self.process and not stoppedByItself and self.process.poll() is None:
+			self.process.kill()
+		if self.reader:
+			self.reader.join()
+		if self.process:
+			self.process.stdout.close()
+			self.process.wait()
+		if self.errorLog:
+			try:
+				if stoppedByItself:
+					CheckFFmpegExit(self.process, self.errorLog, self.source)
+			finally:
+				self.errorLog.close()
+				self.errorLog = None
+
+# vim: set ts=8 sw=8 noet:
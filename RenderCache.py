@@ -0,0 +1,122 @@
+import os, json, hashlib
+
+class RenderCache:
+	# Bump this whenever rendering changes in a way that would make old
+	# chunks wrong
+	CACHE_VERSION = 1
+	CHUNK_EXTENSION = ".chunk"
+	SOURCE_DIGESTS_FILE = "sources.json"
+
+	# Rendered light data, stored in chunks of frames under a name worked out
+	# from everything that went into rendering them.  Anything that changes
+	# the inputs changes the names, so stale chunks are never read back; they
+	# just age out once the cache is over maxBytes.
+	def __init__(self, cachePath, maxBytes):
+		self.cachePath = cachePath
+		self.maxBytes = maxBytes
+		if not os.path.isdir(cachePath):
+			os.makedirs(cachePath)
+
+	def SourceDigest(self, sourcePath):
+		# Hashing a long video takes a while, so the digest is remembered
+		# for as long as the file keeps its size and modification time
+		digestsPath = os.path.join(self.cachePath, self.SOURCE_DIGESTS_FILE)
+		try:
+			with open(digestsPath) as digestsFile:
+				digests = json.load(digestsFile)
+		except (IOError, OSError, ValueError):
+			digests = {}
+
+		sourceStat = os.stat(sourcePath)
+		digestKey = os.path.abspath(sourcePath)
+		known = digests.get(digestKey)
+		if known and known["size"] == sourceStat.st_size and known["mtime"] == sourceStat.st_mtime:
+			return known["digest"]
+
+		sourceHash = hashlib.sha1()
+		with open(sourcePath, "rb") as sourceFile:
+			while True:
+				block = sourceFile.read(1 << 20)
+				if not block:
+					break
+				sourceHash.update(block)
+
+		digests[digestKey] = {
+			"size": sourceStat.st_size,
+			"mtime": sourceStat.st_mtime,
+			"digest": sourceHash.hexdigest(),
+		}
+		tempPath = "%s.%d.tmp" % (digestsPath, os.getpid())
+		with open(tempPath, "w") as digestsFile:
+			json.dump(digests, digestsFile, indent=1, sort_keys=True)
+		os.rename(tempPath, digestsPath)
+
+		return digests[digestKey]["digest"]
+
+	def RenderKey(self, sourcePath, settings):
+		# settings is anything JSON can represent: the layout, FPS, sampling
+		# mode and so on
+		renderHash = hashlib.sha1()
+		renderHash.update(json.dumps(
+			[self.CACHE_VERSION, self.SourceDigest(sourcePath), settings],
+			sort_keys=True).encode("utf-8"))
+		return renderHash.hexdigest()
+
+	def ChunkPath(self, renderKey, firstFrame, frameCount):
+		chunkHash = hashlib.sha1()
+		chunkHash.update(("%s:%d:%d" % (renderKey, firstFrame, frameCount)).encode("utf-8"))
+		return os.path.join(self.cachePath, chunkHash.hexdigest() + self.CHUNK_EXTENSION)
+
+	def Has(self, renderKey, firstFrame, frameCount, expectedBytes):
+		try:
+			chunkStat = os.stat(self.ChunkPath(renderKey, firstFrame, frameCount))
+		except OSError:
+			return False
+		return chunkStat.st_size == expectedBytes
+
+	def Get(self, renderKey, firstFrame, frameCount, expectedBytes):
+		chunkPath = self.ChunkPath(renderKey, firstFrame, frameCount)
+		try:
+			with open(chunkPath, "rb") as chunkFile:
+				chunkData = chunkFile.read()
+		except (IOError, OSError):
+			return None
+		if len(chunkData) != expectedBytes:
+			return None
+
+		# Mark it as recently used
+		os.utime(chunkPath, None)
+		return chunkData
+
+	def Put(self, renderKey, firstFrame, frameCount, chunkData):
+		chunkPath = self.ChunkPath(renderKey, firstFrame, frameCount)
+		tempPath = "%s.%d.tmp" % (chunkPath, os.getpid())
+		with open(tempPath, "wb") as chunkFile:
+			chunkFile.write(chunkData)
+		os.rename(tempPath, chunkPath)
+		self.Evict()
+
+	def Evict(self):
+		# Throw away the least recently used chunks until the cache fits
+		chunks = []
+		totalBytes = 0
+		for fileName in os.listdir(self.cachePath):
+			if not fileName.endswith(self.CHUNK_EXTENSION):
+				continue
+			chunkPath = os.path.join(self.cachePath, fileName)
+			try:
+				chunkStat = os.stat(chunkPath)
+			except OSError:
+				continue
+			chunks.append((chunkStat.st_mtime, chunkStat.st_size, chunkPath))
+			totalBytes += chunkStat.st_size
+
+		chunks.sort()
+		for lastUsed, chunkBytes, chunkPath in chunks:
+			if totalBytes <= self.maxBytes:
+				break
+			try:
+				os.unlink(chunkPath)
+			except OSError:
+				pass
+			totalBytes -= chunkBytes
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+import os, struct, zlib, argparse
+import numpy
+from FrameWriter import FrameWriter
+from DeltaStream import DeltaReader, DELTA_MAGIC
+
+# A render container is a small header, then the frames in chunks, then an
+# index of where every chunk starts.  Each chunk starts on a whole frame and
+# can be decoded by itself, so any frame is one index lookup and one chunk
+# read away.  Chunks carry their own little header too, so a container can
+# still be read front to back from a pipe, or if the index never got written.
+#
+# Header:       magic, version, header size, light count, fps, frame count,
+#               channel order, frames per chunk, chunk count, compression,
+#               index offset (0 until the render finishes)
+# Chunk:        frame count, stored size, crc32 of the stored bytes, data
+# Index entry:  data offset, frame count, stored size
+CONTAINER_MAGIC = b"LRND"
+CONTAINER_VERSION = 1
+HEADER_FORMAT = "<4sHHIII4sIIB3xQ"
+CHUNK_FORMAT = "<III"
+INDEX_FORMAT = "<QII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_FORMAT)
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_FORMAT)
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB}
+
+CONTAINER_EXTENSION = ".lrc"
+
+class ContainerWriter(FrameWriter):
+	def __init__(self, outputPath, frameShape, flushFrames, onFlush=None,
+			fps=20, compression="none", channelOrder="RGB"):
+		FrameWriter.__init__(self, outputPath, frameShape, flushFrames, onFlush)
+		self.lightCount = frameShape[0]
+		self.fps = fps
+		self.compression = COMPRESSIONS[compression]
+		self.channelOrder = channelOrder
+		self.chunkIndex = []
+
+		# A header with no index, which is rewritten once everything is in
+		self._WriteHeader()
+
+	def _WriteHeader(self, indexOffset=0):
+		self.outputFile.write(struct.pack(
+			HEADER_FORMAT, CONTAINER_MAGIC, CONTAINER_VERSION, HEADER_SIZE,
+			self.lightCount, self.fps, self.framesWritten,
+			self.channelOrder.encode("ascii").ljust(4, b"\0"),
+			len(self.frameBuffer), len(self.chunkIndex), self.compression, indexOffset))
+
+	def _WriteChunk(self, frames):
+		chunkData = frames.tobytes()
+		if self.compression == COMPRESSION_ZLIB:
+			chunkData = zlib.compress(chunkData)
+		self.outputFile.write(struct.pack(
+			CHUNK_FORMAT, len(frames), len(chunkData), zlib.crc32(chunkData) & 0xffffffff))
+		self.chunkIndex.append((self.outputFile.tell(), len(frames), len(chunkData)))
+		self.outputFile.write(chunkData)
+
+	def Close(self):
+		self.Flush()
+		indexOffset = self.outputFile.tell()
+		for indexEntry in self.chunkIndex:
+			self.outputFile.write(struct.pack(INDEX_FORMAT, *indexEntry))
+		self.outputFile.seek(0)
+		self._WriteHeader(indexOffset)
+		self.outputFile.close()
+
+class ContainerReader:
+	# Reads a container as if it were a raw render: read() and seek() work in
+	# bytes of raw rgb frames, so code written for .bin files doesn't need to
+	# know the difference.  magic is whatever has already been read from the
+	# start of fileObject.
+	def __init__(self, fileObject, magic=b""):
+		self.fileObject = fileObject
+		header = magic + self._ReadExactly(HEADER_SIZE - len(magic))
+		(magic, version, headerSize, self.lightCount, self.fps, self.frameCount,
+			channelOrder, self.chunkFrames, chunkCount, self.compression,
+			indexOffset) = struct.unpack(HEADER_FORMAT, header)
+		if magic != CONTAINER_MAGIC:
+			raise ValueError("Not a render container")
+		if version > CONTAINER_VERSION:
+			raise ValueError("Render container version %d is too new" % version)
+		self._ReadExactly(headerSize - HEADER_SIZE)
+
+		self.channelOrder = channelOrder.rstrip(b"\0").decode("ascii")
+		self.frameBytes = self.lightCount * len(self.channelOrder)
+
+		# The decoded chunk I'm part way through, and where I am in it
+		self.chunkNumber = -1
+		self.chunkData = b""
+		self.chunkOffset = 0
+
+		try:
+			self.fileObject.seek(headerSize)
+			self.seekable = True
+		except (IOError, OSError, AttributeError):
+			self.seekable = False
+
+		self.chunkIndex = None
+		if self.seekable:
+			if indexOffset:
+				self.fileObject.seek(indexOffset)
+				indexData = self._ReadExactly(chunkCount * INDEX_ENTRY_SIZE)
+				self.chunkIndex = [
+					struct.unpack_from(INDEX_FORMAT, indexData, entry * INDEX_ENTRY_SIZE)
+					for entry in range(chunkCount)]
+			else:
+				self.chunkIndex = self._ScanChunks(headerSize)
+			self.frameCount = sum(frames for offset, frames, size in self.chunkIndex)
+
+	def _ReadExactly(self, size):
+		data = self.fileObject.read(size)
+		if len(data) != size:
+			raise IOError("Render container is truncated")
+		return data
+
+	def _ScanChunks(self, headerSize):
+		# The render didn't finish, so find the chunks by walking them, and
+		# stop at the first one that isn't all there
+		chunkIndex = []
+		offset = headerSize
+		fileSize = self.fileObject.seek(0, os.SEEK_END) or self.fileObject.tell()
+		while offset + CHUNK_HEADER_SIZE <= fileSize:
+			self.fileObject.seek(offset)
+			frames, storedSize, crc = struct.unpack(
+				CHUNK_FORMAT, self._ReadExactly(CHUNK_HEADER_SIZE))
+			dataOffset = offset + CHUNK_HEADER_SIZE
+			if not frames or dataOffset + storedSize > fileSize:
+				break
+			chunkIndex.append((dataOffset, frames, storedSize))
+			offset = dataOffset + storedSize
+		return chunkIndex
+
+	def _Decode(self, chunkData, frames, crc):
+		if zlib.crc32(chunkData) & 0xffffffff != crc:
+			raise IOError("Render container chunk is corrupt")
+		if self.compression == COMPRESSION_ZLIB:
+			chunkData = zlib.decompress(chunkData)
+		if len(chunkData) != frames * self.frameBytes:
+			raise IOError("Render container chunk is the wrong size")
+		return chunkData
+
+	def _LoadChunk(self, chunkNumber):
+		if chunkNumber == self.chunkNumber:
+			return True
+
+		if self.chunkIndex is not None:
+			if chunkNumber >= len(self.chunkIndex):
+				return False
+			dataOffset, frames, storedSize = self.chunkIndex[chunkNumber]
+			self.fileObject.seek(dataOffset - CHUNK_HEADER_SIZE)
+			chunkRecord = self._ReadExactly(CHUNK_HEADER_SIZE + storedSize)
+			frames, storedSize, crc = struct.unpack_from(CHUNK_FORMAT, chunkRecord)
+			chunkData = chunkRecord[CHUNK_HEADER_SIZE:]
+		else:
+			# Streaming, so the only chunk I can get is the next one
+			if chunkNumber != self.chunkNumber + 1:
+				raise IOError("Can't seek in a streamed render container")
+			chunkHeader = self.fileObject.read(CHUNK_HEADER_SIZE)
+			if len(chunkHeader) < CHUNK_HEADER_SIZE:
+				return False
+			frames, storedSize, crc = struct.unpack(CHUNK_FORMAT, chunkHeader)
+			chunkData = self.fileObject.read(storedSize)
+			if not frames or len(chunkData) < storedSize:
+				return False
+
+		self.chunkData = self._Decode(chunkData, frames, crc)
+		self.chunkNumber = chunkNumber
+		return True
+
+	def tell(self):
+		chunkStart = max(self.chunkNumber, 0) * self.chunkFrames * self.frameBytes
+		return chunkStart + self.chunkOffset
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self.tell()
+		elif whence == os.SEEK_END:
+			offset += self.frameCount * self.frameBytes
+		if offset < 0:
+			raise IOError("Can't seek before the start of a render")
+
+		# Every chunk but the last holds chunkFrames frames, so finding the
+		# right one is just a division
+		chunkBytes = self.chunkFrames * self.frameBytes
+		chunkNumber, chunkOffset = divmod(offset, chunkBytes)
+		if not self._LoadChunk(chunkNumber):
+			self.chunkNumber, self.chunkData = chunkNumber, b""
+		self.chunkOffset = chunkOffset
+		return offset
+
+	def SeekFrame(self, frameNumber):
+		return self.seek(frameNumber * self.frameBytes) // self.frameBytes
+
+	def SeekTime(self, seconds):
+		return self.SeekFrame(int(seconds * self.fps))
+
+	def read(self, size=-1):
+		pieces = []
+		while size:
+			if self.chunkNumber < 0 or self.chunkOffset >= len(self.chunkData):
+				if self.chunkNumber >= 0 and self.chunkOffset < self.chunkFrames * self.frameBytes:
+					# A short chunk is the last one
+					break
+				if not self._LoadChunk(self.chunkNumber + 1):
+					break
+				self.chunkOffset = 0
+			piece = self.chunkData[self.chunkOffset:
+				self.chunkOffset + size if size > 0 else len(self.chunkData)]
+			self.chunkOffset += len(piece)
+			pieces.append(piece)
+			if size > 0:
+				size -= len(piece)
+		return b"".join(pieces)
+
+	def ReadFrame(self, frameNumber):
+		self.SeekFrame(frameNumber)
+		return self.read(self.frameBytes)
+
+	def close(self):
+		self.fileObject.close()
+
+class _PeekedStream:
+	# Puts bytes already read from an unseekable stream back in front of it
+	def __init__(self, peeked, fileObject):
+		self.peeked = peeked
+		self.fileObject = fileObject
+
+	def read(self, size=-1):
+		if not self.peeked:
+			return self.fileObject.read(size)
+		if size < 0:
+			data, self.peeked = self.peeked + self.fileObject.read(), b""
+			return data
+		data, self.peeked = self.peeked[:size], self.peeked[size:]
+		if len(data) < size:
+			data += self.fileObject.read(size - len(data))
+		return data
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		raise IOError("Stream isn't seekable")
+
+	def close(self):
+		self.fileObject.close()
+
+def OpenRender(fileObject):
+	# Whatever fileObject holds, a raw render, a container or a delta
+	# stream, return something that reads raw frames from it, and the
+	# container reader or None
+	magic = fileObject.read(len(CONTAINER_MAGIC))
+	if magic == CONTAINER_MAGIC:
+		container = ContainerReader(fileObject, magic)
+		return container, container
+	if magic == DELTA_MAGIC:
+		return DeltaReader(fileObject, magic), None
+	try:
+		fileObject.seek(0)
+		return fileObject, None
+	except (IOError, OSError, AttributeError):
+		return _PeekedStream(magic, fileObject), None
+
+def Pack(inputFile, outputPath, lightCount, fps, compression, chunkFrames):
+	writer = ContainerWriter(
+		outputPath, (lightCount, 3), chunkFrames, fps=fps, compression=compression)
+	try:
+		while True:
+			frames = inputFile.read(chunkFrames * lightCount * 3)
+			frames = frames[:len(frames) - len(frames) % (lightCount * 3)]
+			if not frames:
+				break
+			writer.WriteFrames(numpy.frombuffer(frames, dtype=numpy.uint8))
+	finally:
+		writer.Close()
+
+def Unpack(inputFile, outputFile):
+	render, container = OpenRender(inputFile)
+	while True:
+		data = render.read(1 << 20)
+		if not data:
+			break
+		outputFile.write(data)
+
+if __name__ == "__main__":
+	from constants import CARTESIAN_COORDS, FPS
+
+	parser = argparse.ArgumentParser(
+		description='Convert between raw renders and render containers')
+	subparsers = parser.add_subparsers(dest='command')
+
+	packParser = subparsers.add_parser('pack', help='Raw render to container')
+	packParser.add_argument('input', type=argparse.FileType('rb'))
+	packParser.add_argument('output')
+	packParser.add_argument('--lights', type=int, default=len(CARTESIAN_COORDS))
+	packParser.add_argument('--fps', type=int, default=FPS)
+	packParser.add_argument('--chunk-frames', dest='chunk_frames', type=int, default=1200)
+	packParser.add_argument('-z', '--compression', choices=sorted(COMPRESSIONS), default='zlib')
+
+	unpackParser = subparsers.add_parser('unpack',
+		help='Container (or raw render) to raw render, for the LED controller')
+	unpackParser.add_argument('input', type=argparse.FileType('rb'))
+	unpackParser.add_argument('output', type=argparse.FileType('wb'))
+
+	args = parser.parse_args()
+
+	if args.command == 'pack':
+		Pack(args.input, args.output, args.lights, args.fps, args.compression, args.chunk_frames)
+	elif args.command == 'unpack':
+		Unpack(args.input, args.output)
+	else:
+		parser.print_help()
+
+# vim: set ts=8 sw=8 noet:
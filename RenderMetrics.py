@@ -0,0 +1,134 @@
+import sys, time, json
+
+# Where a render's time goes.  Time is added up per stage as it's spent,
+# and the frames done so far are reported on a progress line at most once
+# every progressInterval seconds, so nothing here costs more than a clock
+# read per frame.  hooks are called with the metrics every time progress
+# is reported, for anything that wants to watch a render from Python.
+#
+#   probe    asking ffprobe (or PyAV) about the video
+#   decode   waiting on the decoder for frames (or loading PNGs)
+#   sample   reducing frames to lights
+#   cache    looking up and reading rendered chunks
+#   write    handing frames to the writer, and it writing them out and
+#            storing them in the cache
+#   wait     waiting on --jobs worker processes
+#
+# With --jobs, decode and sample are added up across the workers, so they
+# can add up to more than the time the render took.
+STAGES = ["probe", "decode", "sample", "cache", "write", "wait"]
+
+PROGRESS_INTERVAL = 1.0
+
+monotonic = getattr(time, "monotonic", time.time)
+
+def FormatDuration(seconds):
+	seconds = int(seconds)
+	return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class StageTimer:
+	def __init__(self, metrics, stage):
+		self.metrics = metrics
+		self.stage = stage
+
+	def __enter__(self):
+		self.started = self.metrics.clock()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.metrics.stageSeconds[self.stage] += self.metrics.clock() - self.started
+		return False
+
+class RenderMetrics:
+	def __init__(self, totalFrames=0, progressInterval=PROGRESS_INTERVAL, output=sys.stdout,
+			clock=monotonic):
+		self.totalFrames = totalFrames
+		self.progressInterval = progressInterval
+		self.output = output
+		self.clock = clock
+		self.hooks = []
+
+		self.stageSeconds = dict((stage, 0.0) for stage in STAGES)
+		self.framesDone = 0
+		self.started = clock()
+		self.finished = None
+		self.lastProgress = None
+
+		# Anything else worth keeping with the numbers, like the settings
+		self.info = {}
+
+		# A progress line rewrites itself on a terminal, and is a line per
+		# report anywhere else
+		isatty = getattr(output, "isatty", None)
+		self.lineEnd = "\r" if isatty and isatty() else "\n"
+
+	def Stage(self, stage):
+		# with metrics.Stage("write"): ...
+		return StageTimer(self, stage)
+
+	def AddStageSeconds(self, stageSeconds):
+		for stage, seconds in stageSeconds.items():
+			self.stageSeconds[stage] += seconds
+
+	def Elapsed(self):
+		return (self.finished or self.clock()) - self.started
+
+	def FramesPerSecond(self):
+		elapsed = self.Elapsed()
+		return self.framesDone / elapsed if elapsed > 0 else 0.0
+
+	def FramesDone(self, frames):
+		# frames more are finished; reports progress if it's time to
+		self.framesDone += frames
+		now = self.clock()
+		if self.lastProgress is None or now - self.lastProgress >= self.progressInterval:
+			self.lastProgress = now
+			self.Progress()
+
+	def Progress(self):
+		framesPerSecond = self.FramesPerSecond()
+		if self.totalFrames:
+			line = "Rendered %d/%d frames, %.1f fps" % (
+				self.framesDone, self.totalFrames, framesPerSecond)
+		else:
+			# A live render doesn't know how many frames it'll get
+			line = "Rendered %d frames, %.1f fps" % (self.framesDone, framesPerSecond)
+		if framesPerSecond and self.totalFrames > self.framesDone:
+			line += ", ETA %s" % FormatDuration((self.totalFrames - self.framesDone) / framesPerSecond)
+		self.output.write(line + "   " + self.lineEnd)
+		self.output.flush()
+		for hook in self.hooks:
+			hook(self)
+
+	def Finish(self):
+		self.finished = self.clock()
+		self.Progress()
+		if self.lineEnd != "\n":
+			self.output.write("\n")
+
+	def Summary(self):
+		return {
+			"frames": self.framesDone,
+			"totalFrames": self.totalFrames,
+			"seconds": self.Elapsed(),
+			"framesPerSecond": self.FramesPerSecond(),
+			"stageSeconds": dict(self.stageSeconds),
+			"info": self.info,
+		}
+
+	def Report(self):
+		elapsed = self.Elapsed()
+		lines = ["%d frames in %.2fs, %.1f fps" % (self.framesDone, elapsed, self.FramesPerSecond())]
+		for stage in STAGES:
+			seconds = self.stageSeconds[stage]
+			if seconds:
+				lines.append("  %-7s %8.2fs  %5.1f%%" % (
+					stage, seconds, 100 * seconds / elapsed if elapsed else 0))
+		return "\n".join(lines)
+
+	def Dump(self, path):
+		with open(path, "w") as metricsFile:
+			json.dump(self.Summary(), metricsFile, indent=2, sort_keys=True)
+			metricsFile.write("\n")
+
+# vim: set ts=8 sw=8 noet:
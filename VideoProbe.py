@@ -0,0 +1,90 @@
+import os, json, subprocess
+
+# What I need to know about a video, from its first video stream and the
+# container around it
+PROBE_ENTRIES = "stream=width,height,r_frame_rate,avg_frame_rate,nb_frames,duration:format=duration"
+
+def _ParseRate(rate):
+	# ffprobe gives frame rates as fractions like "30000/1001", and "0/0"
+	# when it doesn't know
+	if not rate:
+		return None
+	numerator, _, denominator = rate.partition("/")
+	if not denominator:
+		return float(numerator) or None
+	if not float(denominator):
+		return None
+	return float(numerator) / float(denominator) or None
+
+def RunProbe(sourcePath):
+	# One ffprobe run for everything, restricted to the first video stream so
+	# audio and data streams can't get mixed into the answer
+	cmd = [
+		"ffprobe", "-v", "error", "-select_streams", "v:0",
+		"-show_entries", PROBE_ENTRIES, "-of", "json", sourcePath]
+	ffProbeSubprocess = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+	ffProbeOutput, ffProbeError = ffProbeSubprocess.communicate()
+	if ffProbeSubprocess.returncode:
+		raise IOError("ffprobe couldn't read %s" % sourcePath)
+
+	probe = json.loads(ffProbeOutput.decode("utf-8"))
+	streams = probe.get("streams") or []
+	if not streams:
+		raise IOError("%s has no video stream" % sourcePath)
+	stream = streams[0]
+
+	duration = probe.get("format", {}).get("duration") or stream.get("duration")
+	frameRate = _ParseRate(stream.get("avg_frame_rate")) or _ParseRate(stream.get("r_frame_rate"))
+	frameCount = stream.get("nb_frames")
+	if frameCount:
+		frameCount = int(frameCount)
+	elif duration and frameRate:
+		frameCount = int(round(float(duration) * frameRate))
+	else:
+		frameCount = None
+
+	return {
+		"duration": float(duration) if duration else None,
+		"width": int(stream["width"]),
+		"height": int(stream["height"]),
+		"frameRate": frameRate,
+		"frameCount": frameCount,
+	}
+
+def _LoadCache(cachePath):
+	try:
+		with open(cachePath) as cacheFile:
+			return json.load(cacheFile)
+	except (IOError, OSError, ValueError):
+		return {}
+
+def _StoreCache(cachePath, cache):
+	# Write a new file and move it into place, so a reader never sees half
+	# a cache
+	tempPath = "%s.%d.tmp" % (cachePath, os.getpid())
+	with open(tempPath, "w") as cacheFile:
+		json.dump(cache, cacheFile, indent=1, sort_keys=True)
+	os.rename(tempPath, cachePath)
+
+def ProbeVideo(sourcePath, cachePath=None, runProbe=RunProbe):
+	# Results are remembered in cachePath, keyed by the file's path, size and
+	# modification time, so probing a file that hasn't changed is free.
+	# runProbe is what asks, if something other than ffprobe is to.
+	if not cachePath:
+		return runProbe(sourcePath)
+
+	sourceStat = os.stat(sourcePath)
+	cacheKey = os.path.abspath(sourcePath)
+	cache = _LoadCache(cachePath)
+	cached = cache.get(cacheKey)
+	if cached and cached["size"] == sourceStat.st_size and cached["mtime"] == sourceStat.st_mtime:
+		return cached["info"]
+
+	info = runProbe(sourcePath)
+	cache[cacheKey] = {
+		"size": sourceStat.st_size,
+		"mtime": sourceStat.st_mtime,
+		"info": info,
+	}
+	_StoreCache(cachePath, cache)
+	return info
@@ -1,5 +1,8 @@
+import os
+from LightLayout import LightLayout, LoadLayout
+
 # 20 lights down, then 20 lights back up at the same heights, 5 times.
-_rows = (range(20)[::-1] + range(20)[::]) * 5
+_rows = (list(range(20))[::-1] + list(range(20))) * 5
 
 # 20 lights switching between cols 0 and 1, then 20 switching between 3 and 2,
 # repeated 5 times offset by 4 columns per repetition.
@@ -7,5 +10,15 @@ _cols = [v + 4 * i for i in range(5)
          for v in [j % 2 for j in range(20)] + [3 - j % 2 for j in range(20)]
          ]
 
-# [(x0,y0), (x1, y1), ... (x199, y199)]
-CARTESIAN_COORDS = zip(_cols, _rows)
+# That serpentine is the layout, unless LIGHT_LAYOUT names a CSV or JSON
+# layout file to use instead (see LightLayout.py)
+if os.environ.get("LIGHT_LAYOUT"):
+    LAYOUT = LoadLayout(os.environ["LIGHT_LAYOUT"])
+else:
+    LAYOUT = LightLayout(_cols, _rows)
+
+# [(x0,y0), (x1, y1), ... (x199, y199)], as a (lights, 2) array
+CARTESIAN_COORDS = LAYOUT.coords
+
+# Frames per second of everything we render, generate and play back
+FPS = 20
@@ -0,0 +1,268 @@
+import errno
+import os
+import select
+import stat
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy
+
+# Where generated frames go.  Frames are packed into one bytes buffer and
+# written with as few calls as the flush policy allows:
+#
+#   flush_frames=1   write every frame as soon as it's made, for live
+#                    playback through a pipe (the default)
+#   flush_frames=N   write every N frames
+#   flush_frames=0   only write once buffer_bytes have piled up, for
+#                    rendering to a file as fast as possible
+#
+# Writes go straight to the file descriptor.  If the reader is slower than
+# we are, a blocking write just waits for it, and a non-blocking one waits
+# in select() until the pipe has room, so nothing is dropped either way.
+# If the reader goes away, the sink closes quietly and write() starts
+# returning False.
+#
+# For live playback, offer() sends a frame only if the reader has room for
+# it right now, so a slow reader costs dropped frames instead of a backlog
+# of stale ones.  A pipe's own buffer holds a hundred or so frames, which
+# is a backlog too, so pipe_bytes shrinks it where the OS lets us.
+DEFAULT_BUFFER_BYTES = 1 << 20
+
+# fcntl only has a name for it from Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class FrameSink(object):
+    def __init__(self, output=None, flush_frames=1, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 nonblocking=False, pipe_bytes=None):
+        if flush_frames < 0:
+            raise ValueError("flush_frames can't be negative, not %d" % flush_frames)
+        if output is None:
+            output = getattr(sys.stdout, 'buffer', sys.stdout)
+        # a file we opened ourselves is ours to close
+        self.owns_output = isinstance(output, str)
+        if self.owns_output:
+            output = open(output, 'wb')
+        self.output = output
+        self.flush_frames = flush_frames
+        self.buffer_bytes = buffer_bytes
+
+        # anything already written through the file object has to go out
+        # before we start writing around it
+        self.output.flush()
+        try:
+            self.fd = self.output.fileno()
+        except (AttributeError, IOError, ValueError):
+            self.fd = None
+
+        # offer() needs to find out that the reader is full without
+        # waiting for it
+        self.saved_flags = None
+        if nonblocking and self.fd is not None and fcntl:
+            self.saved_flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, self.saved_flags | os.O_NONBLOCK)
+
+        if (pipe_bytes and self.fd is not None and fcntl and sys.platform.startswith('linux')
+                and stat.S_ISFIFO(os.fstat(self.fd).st_mode)):
+            try:
+                fcntl.fcntl(self.fd, F_SETPIPE_SZ, pipe_bytes)
+            except (IOError, OSError):
+                pass
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_frames = 0
+
+        self.closed = False
+        self.frames_written = 0
+        self.writes = 0
+        self.stalls = 0
+        self.refused = 0
+
+    def write(self, frames):
+        # frames is one frame shaped (lights, 3), or a block of them shaped
+        # (frames, lights, 3)
+        if self.closed:
+            return False
+        frames = numpy.asarray(frames, dtype=numpy.uint8)
+        frames = frames.reshape(-1, frames.shape[-2] * frames.shape[-1])
+
+        while len(frames):
+            take = len(frames)
+            if self.flush_frames:
+                take = min(take, self.flush_frames - self.pending_frames)
+            self.pending.append(frames[:take].tobytes())
+            self.pending_bytes += len(self.pending[-1])
+            self.pending_frames += take
+            frames = frames[take:]
+
+            if ((self.flush_frames and self.pending_frames >= self.flush_frames) or
+                    self.pending_bytes >= self.buffer_bytes):
+                if not self.flush():
+                    return False
+        return True
+
+    def flush(self):
+        if self.closed:
+            return False
+        if not self.pending:
+            return True
+        data = b''.join(self.pending)
+        frames = self.pending_frames
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_frames = 0
+
+        try:
+            if self.fd is None:
+                self.output.write(data)
+                self.output.flush()
+                self.writes += 1
+            else:
+                self._write_fd(data)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # the reader hung up
+            self.closed = True
+            return False
+
+        self.frames_written += frames
+        return True
+
+    def offer(self, frame):
+        # Send one frame if it can go right now; returns whether it went.
+        # Once part of a frame is out the rest has to follow, or the reader
+        # would lose track of where frames start.
+        if not self.flush():
+            return False
+        data = numpy.asarray(frame, dtype=numpy.uint8).tobytes()
+        if self.fd is None or self.saved_flags is None:
+            self.pending, self.pending_bytes, self.pending_frames = [data], len(data), 1
+            return self.flush()
+
+        try:
+            written = os.write(self.fd, data)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.refused += 1
+                return False
+            if e.errno == errno.EPIPE:
+                self.closed = True
+                return False
+            raise
+        self.writes += 1
+        if written < len(data):
+            self.stalls += 1
+            try:
+                self._write_fd(data[written:])
+            except (IOError, OSError) as e:
+                if e.errno != errno.EPIPE:
+                    raise
+                # the reader hung up part way through the frame
+                self.closed = True
+                return False
+        self.frames_written += 1
+        return True
+
+    def _write_fd(self, data):
+        view = memoryview(data)
+        while len(view):
+            try:
+                written = os.write(self.fd, view)
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                # a non-blocking pipe is full, so wait for the reader
+                self.stalls += 1
+                select.select([], [self.fd], [])
+                continue
+            self.writes += 1
+            view = view[written:]
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        if self.saved_flags is not None:
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, self.saved_flags)
+            self.saved_flags = None
+        if self.owns_output and not self.output.closed:
+            self.output.close()
+
+
+class Pacer(object):
+    # Keeps frames on a schedule of fps frames a second from the first one,
+    # by a monotonic clock so nothing drifts if the wall clock is changed.
+    # wait() sleeps until a frame is due, and says whether it's still worth
+    # sending: a frame whose whole slot has gone by is dropped, and the
+    # caller skips ahead to the frame that's due now.
+    def __init__(self, fps, late_seconds=None, clock=monotonic, sleep=time.sleep):
+        self.period = 1.0 / fps
+        if late_seconds is None:
+            late_seconds = self.period / 4
+        self.late_seconds = late_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+
+        self.sent = 0
+        self.late = 0
+        self.dropped = 0
+        self.refused = 0
+
+        # how far after its deadline each sent frame went out
+        self.lateness = []
+
+    def deadline(self, frame_number):
+        return self.start + frame_number * self.period
+
+    def wait(self, frame_number):
+        if self.start is None:
+            self.start = self.clock() - frame_number * self.period
+        delay = self.deadline(frame_number) - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        lateness = self.clock() - self.deadline(frame_number)
+        if lateness >= self.period:
+            return False
+        self.lateness.append(max(lateness, 0.0))
+        return True
+
+    def due_frame(self):
+        # the frame whose slot we're in now
+        return int((self.clock() - self.start) / self.period)
+
+    def skip(self, frame_number):
+        # frame_number missed its slot; returns the frame to make instead
+        due = max(self.due_frame(), frame_number + 1)
+        self.dropped += due - frame_number
+        return due
+
+    def record(self, sent):
+        # whether the reader took the frame that was just offered
+        if sent:
+            self.sent += 1
+            if self.lateness and self.lateness[-1] > self.late_seconds:
+                self.late += 1
+        else:
+            self.refused += 1
+            self.lateness.pop()
+
+    def report(self):
+        lines = ["%d frames sent, %d late (over %.1fms), %d dropped falling behind, "
+                 "%d dropped because the reader was full" % (
+                     self.sent, self.late, self.late_seconds * 1000,
+                     self.dropped, self.refused)]
+        if self.lateness:
+            lateness = numpy.array(self.lateness) * 1000
+            lines.append("jitter: mean %.2fms, 95%% %.2fms, 99%% %.2fms, max %.2fms" % (
+                lateness.mean(), numpy.percentile(lateness, 95),
+                numpy.percentile(lateness, 99), lateness.max()))
+        return "\n".join(lines)
@@ -0,0 +1,307 @@
+import argparse
+import collections
+import multiprocessing
+import sys
+
+import numpy
+
+from constants import LAYOUT, FPS
+from frame_sink import FrameSink, Pacer
+
+# Patterns work on whole arrays at once instead of one light at a time.
+# get_hsv(x, y, i) gets the coordinates of every light as x and y, shaped
+# (lights,), and a column of frame numbers as i, shaped (frames, 1), so
+# plain arithmetic on them broadcasts out to a (frames, lights) block.
+FRAMES = 6000
+BLOCK_FRAMES = 500
+POLAR_CACHE_SIZE = 64
+
+# 8 bit colour can't tell more hues apart than 16 bits give, and the hue
+# table doubles with every bit
+MIN_HUE_BITS = 1
+MAX_HUE_BITS = 16
+
+COORDS = LAYOUT.coords.astype(float)
+X = COORDS[:, 0]
+Y = COORDS[:, 1]
+
+
+def hsv_to_rgb(h, s, v):
+    # the same arithmetic as colorsys.hsv_to_rgb, on arrays
+    h, s, v = numpy.broadcast_arrays(h, s, v)
+    i = numpy.floor(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(int) % 6
+
+    r = numpy.choose(i, [v, q, p, p, t, v])
+    g = numpy.choose(i, [t, v, v, q, p, p])
+    b = numpy.choose(i, [p, p, t, v, v, q])
+    return r, g, b
+
+
+_hue_tables = {}
+
+
+def hsv_to_rgb_lut(h, s, v, hue_bits):
+    # An approximate hsv_to_rgb for speed: hue is rounded to one of
+    # 2 ** hue_bits steps and looked up in a table of fully saturated
+    # colours, and saturation and value are applied to that, which is
+    # exactly what hsv_to_rgb does to the colour for that hue.
+    if hue_bits not in _hue_tables:
+        steps = 1 << hue_bits
+        hues = (numpy.arange(steps) + 0.5) / steps
+        _hue_tables[hue_bits] = numpy.stack(hsv_to_rgb(hues, 1.0, 1.0), axis=-1)
+    table = _hue_tables[hue_bits]
+
+    h, s, v = numpy.broadcast_arrays(h, s, v)
+    steps = len(table)
+    hue_rgb = table[(h * steps).astype(int) % steps]
+    rgb = v[..., numpy.newaxis] * (1.0 - s[..., numpy.newaxis] * (1.0 - hue_rgb))
+    return rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+
+def to_bytes(r, g, b):
+    # 0-1 floats to 0-255, truncating like int(255 * r) does
+    rgb = numpy.stack([r, g, b], axis=-1)
+    return (255 * rgb).astype(numpy.uint8)
+
+
+class Bounce(object):
+    # A coordinate that moves by step every frame and turns around once it
+    # leaves [low, high].  Each frame depends on the one before, so I walk
+    # it one frame at a time, but only once, and look frames up after that.
+    def __init__(self, start, direction, step, low, high):
+        self.positions = [start]
+        self.direction = direction
+        self.step = step
+        self.low, self.high = low, high
+
+    def __call__(self, i):
+        i = numpy.asarray(i)
+        while len(self.positions) <= i.max():
+            position = self.positions[-1] + self.direction * self.step
+            if position < self.low or position > self.high:
+                self.direction *= -1
+            self.positions.append(position)
+        return numpy.array(self.positions)[i]
+
+
+class PolarCache(object):
+    # The distance and angle from a center to every light only change when
+    # the center moves, so I keep them for the last few centers I've seen
+    # and throw out whichever was used longest ago.
+    def __init__(self, size=POLAR_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.x = self.y = None
+
+    def __call__(self, x, y, center_x, center_y):
+        # center_x and center_y are numbers, or (frames, 1) columns for a
+        # center that moves; returns distance and angle shaped like x and y
+        # were broadcast against them
+        if x is not self.x or y is not self.y:
+            self.entries.clear()
+            self.x, self.y = x, y
+
+        center_x, center_y = numpy.broadcast_arrays(center_x, center_y)
+        if not center_x.ndim:
+            return self._lookup([(float(center_x), float(center_y))])[0]
+
+        centers = list(zip(center_x.ravel().tolist(), center_y.ravel().tolist()))
+        polar = self._lookup(centers)
+        shape = center_x.shape[:-1] + (len(x),)
+        distance = numpy.array([d for d, a in polar]).reshape(shape)
+        angle = numpy.array([a for d, a in polar]).reshape(shape)
+        return distance, angle
+
+    def _lookup(self, centers):
+        # every center that isn't cached yet is worked out in one go
+        missing = [center for center in collections.OrderedDict.fromkeys(centers)
+                   if center not in self.entries]
+        computed = {}
+        if missing:
+            center_x, center_y = numpy.array(missing).T[:, :, numpy.newaxis]
+            distance = ((self.x - center_x) ** 2 + (self.y - center_y) ** 2) ** 0.5
+            angle = numpy.arctan2(self.y - center_y, self.x - center_x)
+            computed = dict(zip(missing, zip(distance, angle)))
+
+        polar = []
+        for center in centers:
+            entry = self.entries.pop(center, None) or computed[center]
+            self.entries[center] = entry
+            polar.append(entry)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return polar
+
+
+class FrameSource(object):
+    # Anything that can render frames: a pattern, or a playlist of them.
+    # A frame_pure source's frames depend on nothing but the frame number,
+    # so blocks of them can be rendered in any order, in any process.
+    frame_pure = True
+
+    def render(self, first_frame, frame_count, out=None):
+        raise NotImplementedError
+
+    def blocks(self, frames=FRAMES, block_frames=BLOCK_FRAMES):
+        for first_frame in range(0, frames, block_frames):
+            yield self.render(first_frame, min(block_frames, frames - first_frame))
+
+
+class Pattern(FrameSource):
+    # None for exact colours, or how many bits of hue to keep when looking
+    # colours up in a table instead (see hsv_to_rgb_lut)
+    hue_bits = None
+
+    def __init__(self):
+        self.polar = PolarCache()
+        self._unique_coords = None
+
+    def get_hsv(self, x, y, i):
+        raise NotImplementedError
+
+    def transform_coords(self, x, y):
+        # Patterns that are symmetrical can map lights onto each other here;
+        # lights that end up at the same place are only computed once
+        return x, y
+
+    def unique_coords(self, x, y):
+        # the distinct lights after transform_coords, and where each of the
+        # original lights is among them
+        cached = self._unique_coords
+        if cached is None or cached[0] is not x or cached[1] is not y:
+            tx, ty = self.transform_coords(x, y)
+            coords, lights = numpy.unique(numpy.stack([tx, ty], axis=-1), axis=0, return_inverse=True)
+            self._unique_coords = (x, y, coords[:, 0], coords[:, 1], lights.ravel())
+        return self._unique_coords[2:]
+
+    def render(self, first_frame, frame_count, out=None, x=X, y=Y):
+        # frames first_frame onwards, as a (frames, lights, 3) array of
+        # bytes, in out if it's given
+        ux, uy, lights = self.unique_coords(x, y)
+        i = numpy.arange(first_frame, first_frame + frame_count)[:, numpy.newaxis]
+        shape = (frame_count, len(ux))
+        h, s, v = [numpy.broadcast_to(a, shape) for a in self.get_hsv(ux, uy, i)]
+        if self.hue_bits is not None:
+            rgb = hsv_to_rgb_lut(h, s, v, self.hue_bits)
+        else:
+            rgb = hsv_to_rgb(h, s, v)
+        return numpy.take(to_bytes(*rgb), lights, axis=1, out=out)
+
+
+def run_realtime(pattern, sink, pacer, frames=FRAMES):
+    # Each frame is made before its slot comes up, then sent right on time.
+    # A frame that's missed its slot, or that the reader has no room for,
+    # is dropped rather than sent late.
+    frame_number = 0
+    while frame_number < frames and not sink.closed:
+        frame = pattern.render(frame_number, 1)[0]
+        if not pacer.wait(frame_number):
+            frame_number = pacer.skip(frame_number)
+            continue
+        pacer.record(sink.offer(frame))
+        frame_number += 1
+
+
+_block_source = None
+
+
+def _init_block_worker(source):
+    global _block_source
+    _block_source = source
+
+
+def render_block(block):
+    first_frame, frame_count = block
+    return _block_source.render(first_frame, frame_count).copy()
+
+
+def hue_bits_argument(text):
+    try:
+        hue_bits = int(text)
+    except ValueError:
+        hue_bits = None
+    if hue_bits is None or not MIN_HUE_BITS <= hue_bits <= MAX_HUE_BITS:
+        raise argparse.ArgumentTypeError("has to be a whole number from %d to %d, not %r" % (
+            MIN_HUE_BITS, MAX_HUE_BITS, text))
+    return hue_bits
+
+
+def add_output_arguments(parser):
+    parser.add_argument('-o', '--output', default=None,
+                        help='File to write to, instead of stdout')
+    parser.add_argument('-f', '--flush-frames', dest='flush_frames', type=int, default=1,
+                        help='Write out every this many frames, or 0 to only '
+                             'write when the buffer is full')
+    parser.add_argument('-r', '--realtime', action='store_true', default=False,
+                        help='Send frames at --fps, dropping any that would be late')
+    parser.add_argument('--fps', type=float, default=FPS,
+                        help='Frames per second in --realtime mode')
+    parser.add_argument('--hue-bits', dest='hue_bits', type=hue_bits_argument, default=None,
+                        help='Look colours up in a table with this many bits of '
+                             'hue, %d to %d (faster, but not exact)' % (MIN_HUE_BITS, MAX_HUE_BITS))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Render this many blocks of frames at once in separate '
+                             'processes (not with --realtime)')
+
+
+def play(source, args, frames=FRAMES):
+    # write frames of source wherever add_output_arguments' args say
+    if args.realtime:
+        sink = FrameSink(args.output, nonblocking=True, pipe_bytes=len(X) * 3)
+        pacer = Pacer(args.fps)
+        try:
+            run_realtime(source, sink, pacer, frames)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.close()
+            sys.stderr.write(pacer.report() + "\n")
+        return
+
+    if args.jobs > 1 and not source.frame_pure:
+        sys.stderr.write("Frames depend on the ones before them here, so they "
+                         "have to be rendered in order, in one process\n")
+
+    sink = FrameSink(args.output, flush_frames=args.flush_frames)
+    if args.jobs > 1 and source.frame_pure:
+        pool = multiprocessing.Pool(args.jobs, _init_block_worker, (source,))
+        blocks = pool.imap(render_block, [
+            (first_frame, min(BLOCK_FRAMES, frames - first_frame))
+            for first_frame in range(0, frames, BLOCK_FRAMES)])
+    else:
+        pool = None
+        blocks = source.blocks(frames)
+    try:
+        for block in blocks:
+            if not sink.write(block):
+                # nobody's reading any more
+                break
+    finally:
+        if pool:
+            pool.terminate()
+    sink.close()
+
+
+def check_output_arguments(parser, args):
+    if args.jobs < 1:
+        parser.error("--jobs has to be at least 1")
+    if args.flush_frames < 0:
+        parser.error("--flush-frames can't be negative (0 only writes when the buffer is full)")
+    if args.fps <= 0:
+        parser.error("--fps has to be more than 0")
+    if args.jobs > 1 and args.realtime:
+        parser.error("--jobs doesn't work with --realtime")
+
+
+def run(pattern, frames=FRAMES):
+    parser = argparse.ArgumentParser(description='Write out a light pattern')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    check_output_arguments(parser, args)
+    pattern.hue_bits = args.hue_bits
+    play(pattern, args, frames)
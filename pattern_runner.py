@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+import argparse
+import ast
+import glob
+import importlib
+import inspect
+import os
+import sys
+
+import numpy
+
+import pattern_engine
+from constants import FPS
+
+# Runs one pattern or a whole playlist of them in one process, so a night
+# of patterns pays for Python and numpy starting up once.
+#
+# Patterns are found by importing the generator scripts and picking out
+# their pattern_engine.Pattern subclasses.  A script's class called Pattern
+# is known by the script's name, and any other classes as script.Class.
+# An entry in a playlist is
+#
+#     name[,attribute=value...][@seconds]
+#
+# e.g. rainbow_pinwheel_2,arms=6@60.  Attributes override the pattern's
+# class attributes that are plain numbers, and seconds defaults to as long
+# as the script runs.
+PATTERN_MODULES = ["simple_rainbow*.py", "rainbow_*.py"]
+
+PARAMETER_TYPES = (int, float)
+
+_registry = {}
+
+
+def register(name, pattern_class):
+    _registry[name] = pattern_class
+
+
+def discover(directory=None, modules=()):
+    # import every pattern script in directory, and any modules named, and
+    # register the patterns they define
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    names = list(modules)
+    for module_glob in PATTERN_MODULES:
+        for path in sorted(glob.glob(os.path.join(directory, module_glob))):
+            names.append(os.path.splitext(os.path.basename(path))[0])
+
+    for module_name in names:
+        module = importlib.import_module(module_name)
+        for class_name, pattern_class in inspect.getmembers(module, inspect.isclass):
+            if (not issubclass(pattern_class, pattern_engine.Pattern) or
+                    pattern_class.__module__ != module.__name__):
+                continue
+            if class_name == 'Pattern':
+                register(module_name, pattern_class)
+            else:
+                register("%s.%s" % (module_name, class_name), pattern_class)
+    return _registry
+
+
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def is_parameter_value(value):
+    return isinstance(value, PARAMETER_TYPES) and not isinstance(value, bool)
+
+
+def parameters(pattern):
+    # the pattern's own class attributes that are plain numbers, and still
+    # are on the instance; anything else, like the machinery pattern_engine
+    # gives every pattern or a Bounce made in __init__, isn't for tuning
+    pattern_class = type(pattern)
+    return sorted(
+        attribute for attribute in dir(pattern_class)
+        if not attribute.startswith('_') and not hasattr(pattern_engine.Pattern, attribute)
+        and is_parameter_value(getattr(pattern_class, attribute))
+        and is_parameter_value(getattr(pattern, attribute)))
+
+
+def make_pattern(name, params=None, hue_bits=None):
+    if name not in _registry:
+        raise ValueError("no pattern called %r (try --list)" % name)
+    pattern = _registry[name]()
+    tunable = parameters(pattern)
+    for attribute, value in (params or {}).items():
+        if attribute not in tunable:
+            raise ValueError("%s has no parameter %r (it has %s)" % (
+                name, attribute, ", ".join(tunable) or "none"))
+        if not is_parameter_value(value):
+            raise ValueError("%s's %s has to be a number, not %r" % (name, attribute, value))
+        setattr(pattern, attribute, value)
+    pattern.hue_bits = hue_bits
+    return pattern
+
+
+def parse_entry(text):
+    # name[,attribute=value...][@seconds] -> (name, params, frames or None)
+    entry = text
+    text, _, seconds = text.partition('@')
+    fields = text.split(',')
+    params = {}
+    for field in fields[1:]:
+        attribute, equals, value = field.partition('=')
+        if not equals:
+            raise ValueError("expected attribute=value, not %r" % field)
+        params[attribute.strip()] = parse_value(value.strip())
+    frames = None
+    if seconds:
+        try:
+            frames = int(round(float(seconds) * FPS))
+        except ValueError:
+            raise ValueError("expected a number of seconds in %r, not %r" % (entry, seconds))
+        if frames <= 0:
+            raise ValueError("%r has to play for at least a frame" % entry)
+    return fields[0].strip(), params, frames
+
+
+def read_playlist(path):
+    entries = []
+    with open(path) as playlist:
+        for line in playlist:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                entries.append(line)
+    return entries
+
+
+class PlaylistEntry(object):
+    def __init__(self, pattern, first_frame, frames, fade_in, fade_out):
+        self.pattern = pattern
+        self.first_frame = first_frame
+        self.frames = frames
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+
+    def weights(self, local_frames):
+        # how much of each frame is this pattern, so that two patterns
+        # crossfading always add up to all of the frame
+        weights = numpy.ones(len(local_frames))
+        if self.fade_in:
+            weights = numpy.minimum(weights, (local_frames + 1.0) / (self.fade_in + 1))
+        if self.fade_out:
+            weights = numpy.minimum(weights, (self.frames - local_frames) / (self.fade_out + 1.0))
+        return weights
+
+
+class Playlist(pattern_engine.FrameSource):
+    # Patterns one after another, each starting from its own frame 0, with
+    # the end of one crossfading into the start of the next.  Every block
+    # is mixed in the same preallocated buffers, so what render() returns
+    # is only good until the next call.
+    def __init__(self, patterns, crossfade_frames=0, lights=len(pattern_engine.X),
+                 block_frames=pattern_engine.BLOCK_FRAMES):
+        if crossfade_frames < 0:
+            raise ValueError("crossfades can't be negative")
+        self.entries = []
+        first_frame = 0
+        for number, (pattern, frames) in enumerate(patterns):
+            fade_in = crossfade_frames if number else 0
+            fade_out = crossfade_frames if number < len(patterns) - 1 else 0
+            if frames < fade_in + fade_out:
+                raise ValueError("pattern %d is shorter than its crossfades" % (number + 1))
+            if number:
+                first_frame -= fade_in
+            self.entries.append(PlaylistEntry(pattern, first_frame, frames, fade_in, fade_out))
+            first_frame += frames
+        self.frames = first_frame
+        self.frame_pure = all(entry.pattern.frame_pure for entry in self.entries)
+
+        self.mix = numpy.empty((block_frames, lights, 3))
+        self.rendered = numpy.empty((block_frames, lights, 3), dtype=numpy.uint8)
+        self.output = numpy.empty((block_frames, lights, 3), dtype=numpy.uint8)
+
+    def render(self, first_frame, frame_count, out=None):
+        if frame_count > len(self.output):
+            return numpy.concatenate([
+                self.render(start, min(len(self.output), first_frame + frame_count - start)).copy()
+                for start in range(first_frame, first_frame + frame_count, len(self.output))])
+
+        mix = self.mix[:frame_count]
+        mix.fill(0)
+        last_frame = first_frame + frame_count
+        for entry in self.entries:
+            start = max(first_frame, entry.first_frame)
+            stop = min(last_frame, entry.first_frame + entry.frames)
+            if start >= stop:
+                continue
+            local_start = start - entry.first_frame
+            rendered = entry.pattern.render(local_start, stop - start,
+                                            out=self.rendered[:stop - start])
+            weights = entry.weights(numpy.arange(local_start, local_start + stop - start))
+            mix[start - first_frame:stop - first_frame] += \
+                weights[:, numpy.newaxis, numpy.newaxis] * rendered
+
+        if out is None:
+            out = self.output[:frame_count]
+        # weights of 1 leave whole numbers, which this leaves alone
+        numpy.add(mix, 0.5, out=mix)
+        out[...] = mix
+        return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Play light patterns, one after another, in one process')
+    parser.add_argument('patterns', nargs='*', metavar='PATTERN',
+                        help='name[,attribute=value...][@seconds]')
+    parser.add_argument('-p', '--playlist', default=None,
+                        help='File with a pattern on each line, played before any '
+                             'given on the command line')
+    parser.add_argument('-c', '--crossfade', type=float, default=0,
+                        help='Seconds to crossfade between patterns')
+    parser.add_argument('-m', '--module', action='append', default=[],
+                        help='Also look for patterns in this module')
+    parser.add_argument('-l', '--list', action='store_true', default=False,
+                        help='List the patterns there are and stop')
+    pattern_engine.add_output_arguments(parser)
+    args = parser.parse_args()
+    pattern_engine.check_output_arguments(parser, args)
+    if args.crossfade < 0:
+        parser.error("--crossfade can't be negative")
+
+    discover(modules=args.module)
+    if args.list:
+        for name in sorted(_registry):
+            print(name)
+        sys.exit(0)
+
+    entries = args.patterns
+    if args.playlist:
+        entries = read_playlist(args.playlist) + entries
+    if not entries:
+        parser.error("no patterns to play")
+
+    try:
+        patterns = []
+        for entry in entries:
+            name, params, frames = parse_entry(entry)
+            pattern = make_pattern(name, params, args.hue_bits)
+            patterns.append((pattern, frames if frames is not None else pattern_engine.FRAMES))
+        playlist = Playlist(patterns, int(round(args.crossfade * FPS)))
+    except ValueError as e:
+        parser.error(str(e))
+
+    pattern_engine.play(playlist, args, playlist.frames)
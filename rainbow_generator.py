@@ -1,46 +1,23 @@
 #!/usr/bin/env python
-from constants import CARTESIAN_COORDS
-import colorsys
-import sys
+import pattern_engine
 
-class Pattern(object):
-    center_x, center_y = 15, 10
+class Pattern(pattern_engine.Pattern):
+    # where the center is depends on every frame before
+    frame_pure = False
 
-    mov_x, mov_y = -1, -1
-    i = 0
+    def __init__(self):
+        super(Pattern, self).__init__()
 
-    def next_frame(self):
-        self.i += 1
-        self.center_x += self.mov_x * 0.1
-        self.center_y += self.mov_y * 0.1
+        # the center bounces around, turning back once it's off the edge
+        self.center_x = pattern_engine.Bounce(15, -1, 0.1, 0, 19)
+        self.center_y = pattern_engine.Bounce(10, -1, 0.1, 0, 19)
 
-        if self.center_x < 0 or self.center_x > 19:
-            self.mov_x *= -1
+    def get_hsv(self, x, y, i):
+        center_x, center_y = self.center_x(i), self.center_y(i)
+        d = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
+        d = d * 0.1
+        d = d - 0.025 * i
+        return d % 1, 1, 1
 
-        if self.center_y < 0 or self.center_y > 19:
-            self.mov_y *= -1
-
-    def get_color(self, x, y):
-        d = ((x - self.center_x) ** 2 + (y - self.center_y) ** 2) ** 0.5
-        d *= 0.1
-        d -= 0.025 * self.i
-        r, g, b = colorsys.hsv_to_rgb(d%1, 1, 1)
-
-        red = 255 * r
-        green = 255 * g
-        blue = 255 * b
-        c = (int(red), int(green), int(blue))
-        return c
-
-p = Pattern()
-
-for frame in range(6000):
-    for x, y in CARTESIAN_COORDS:
-        color = p.get_color(x, y)
-        r, g, b = color
-        sys.stdout.write(chr(r))
-        sys.stdout.write(chr(g))
-        sys.stdout.write(chr(b))
-
-    sys.stdout.flush()
-    p.next_frame()
+if __name__ == "__main__":
+    pattern_engine.run(Pattern())
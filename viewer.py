@@ -2,148 +2,635 @@
 import argparse
 import sys
 import os
+import threading
+import mmap
+import time
+import collections
 import pygame
 import pygame.locals
 import pygame.key
 import pygame.time
+import numpy
 
 
-from constants import CARTESIAN_COORDS
+from constants import LAYOUT, FPS
+from RenderContainer import OpenRender
 
-NUM_PIXELS = len(CARTESIAN_COORDS)
+NUM_PIXELS = LAYOUT.lightCount
 BYTES_PER_FRAME = 3 * NUM_PIXELS
-FPS = 20
-FRAMES_PER_SKIP = 5 * FPS
+SECONDS_PER_SKIP = 5
+BUFFER_FRAMES = 2 * FPS
+HISTORY_FRAMES = 30 * FPS
+BUFFERING_RETRY_SECONDS = 0.01
+LIGHT_RADIUS = 17
+
+# the default layout is 19 cells across, which comes out 25 pixels a cell
+# with this margin; LIGHT_RADIUS is for that size, and shrinks with it
+CANVAS_MARGIN = 50
+CELL_PIXELS = 25
+
+# past this many changed lights it's quicker to just draw them all
+FULL_REDRAW_FRACTION = 0.5
 
 CANVAS = pygame.Rect((0, 0), (575, 575))
-STATUSBAR = pygame.Rect(CANVAS.bottomleft, (CANVAS.width, 20))
-SCREEN = pygame.Rect(CANVAS.topleft, (CANVAS.width, CANVAS.height + STATUSBAR.height))
+SEEKBAR = pygame.Rect(CANVAS.bottomleft, (CANVAS.width, 10))
+STATUSBAR = pygame.Rect(SEEKBAR.bottomleft, (CANVAS.width, 20))
+SCREEN = pygame.Rect(CANVAS.topleft, (CANVAS.width, CANVAS.height + SEEKBAR.height + STATUSBAR.height))
 
 #size = width, height + 30
 
-def convert_to_screen_pos(pos):
+monotonic = getattr(time, 'monotonic', time.time)
+
+def convert_to_screen_pos(layout):
+    # every light's position on the canvas, and how many pixels a cell is,
+    # with the whole layout fitted inside the margin
     # upper_left is 0,0
     # bottom left is 0, CANVAS.width
-    x, y = pos
-    scaled_x = (int)(25*x+50)
-    scaled_y = (int)(CANVAS.width - 50 - (25*y))
-    return (scaled_x, scaled_y)
+    left, bottom = layout.x.min(), layout.y.min()
+    span = max(layout.x.max() - left, layout.y.max() - bottom, 1)
+    scale = (CANVAS.width - 2 * CANVAS_MARGIN) / float(span)
+    scaled_x = (scale * (layout.x - left) + CANVAS_MARGIN).astype(int)
+    scaled_y = (CANVAS.width - CANVAS_MARGIN - scale * (layout.y - bottom)).astype(int)
+    return list(zip(scaled_x.tolist(), scaled_y.tolist())), scale
+
+class LightCanvas(object):
+    # Draws frames of lights onto the canvas, touching as little of the
+    # screen as it can.  Lights overlap their neighbours, so a light that
+    # changed is redrawn clipped to its own square, along with every light
+    # that reaches into that square, in the original order.  Labels never
+    # change, so they're rendered once and blitted.
+    #
+    # With use_surfarray the canvas is instead worked out in one go with
+    # numpy: a map of which light (if any) covers each pixel is drawn once,
+    # and each frame is just the frame's colours looked up through it.
+    def __init__(self, screen, layout, number_lights=False, use_surfarray=False):
+        self.screen = screen
+        self.positions, scale = convert_to_screen_pos(layout)
+        self.radius = radius = max(1, int(LIGHT_RADIUS * min(scale / CELL_PIXELS, 1)))
+        self.rects = [pygame.Rect(x - radius, y - radius, 2 * radius + 1, 2 * radius + 1)
+                      for x, y in self.positions]
+
+        # only lights within two radii (and a pixel for rounding) can reach
+        # into each other's squares, so the layout's grid finds the few
+        # worth checking instead of checking every pair
+        reach = (2 * radius + 2) / scale
+        self.overlapping = []
+        for rect, x, y in zip(self.rects, layout.x.tolist(), layout.y.tolist()):
+            nearby = layout.grid.InRect(x - reach, y - reach, x + reach, y + reach)
+            self.overlapping.append([j for j in nearby.tolist() if rect.colliderect(self.rects[j])])
+        self.previous = None
+
+        self.labels = []
+        if number_lights:
+            font = pygame.font.SysFont("monospace", 15)
+            for i, (x, y) in enumerate(self.positions):
+                s = str(i)
+                label = font.render(s, 1, (255, 255, 255))
 
-def get_next_pixel(fin):
-    try:
-        r, g, b = [ord(c) for c in fin.read(3)]
-        return r, g, b
-    except:
-        print "reached the end of the file"
-        sys.exit(0)
-
-def frame_to_timestamp(framenum):
-    usecs = framenum * 1000000 / FPS
+                # center text on the light
+                x_s, y_s = font.size(s)
+                self.labels.append((label, (x - x_s/2, y - y_s/2)))
+
+        self.light_map = None
+        if use_surfarray:
+            self.canvas = pygame.Surface(CANVAS.size, 0, 32)
+            self.light_map = self.build_light_map()
+            self.shifts = numpy.array(self.canvas.get_shifts()[:3], dtype=numpy.uint32)
+
+    def build_light_map(self):
+        # draw every light in its own colour, i + 1, so the pixels say which
+        # light ended up on top; 0 is background
+        surface = pygame.Surface(CANVAS.size, 0, 32)
+        surface.fill((0, 0, 0))
+        for i, pos in enumerate(self.positions):
+            n = i + 1
+            pygame.draw.circle(surface, (n >> 16, (n >> 8) & 0xff, n & 0xff), pos, self.radius)
+        pixels = pygame.surfarray.array3d(surface).astype(numpy.int32)
+        return (pixels[..., 0] << 16 | pixels[..., 1] << 8 | pixels[..., 2]) - 1
+
+    def draw(self, frame):
+        # frame is a (lights, 3) array of colours; returns the rects of the
+        # screen that changed
+        if self.light_map is not None:
+            return self.draw_surfarray(frame)
+
+        if self.previous is None:
+            changed = range(len(self.rects))
+        else:
+            changed = numpy.flatnonzero((frame != self.previous).any(axis=1))
+        self.previous = frame.copy()
+        if not len(changed):
+            return []
+
+        colors = frame.tolist()
+        if len(changed) > FULL_REDRAW_FRACTION * len(self.rects):
+            for i in range(len(self.rects)):
+                self.draw_light(i, colors)
+            return [CANVAS]
+
+        dirty = []
+        for i in changed:
+            self.screen.set_clip(self.rects[i])
+            for j in self.overlapping[i]:
+                self.draw_light(j, colors)
+            dirty.append(self.rects[i])
+        self.screen.set_clip(None)
+        return dirty
+
+    def draw_light(self, i, colors):
+        pygame.draw.circle(self.screen, colors[i], self.positions[i], self.radius)
+        if self.labels:
+            label, pos = self.labels[i]
+            self.screen.blit(label, pos)
+
+    def draw_surfarray(self, frame):
+        if self.previous is not None and numpy.array_equal(frame, self.previous):
+            return []
+        self.previous = frame.copy()
+
+        # each light's colour as the canvas's own pixel value, with one more
+        # black "light" for the background at index -1
+        pixels = numpy.zeros(len(frame) + 1, dtype=numpy.uint32)
+        pixels[:-1] = (frame.astype(numpy.uint32) << self.shifts).sum(axis=1)
+        pygame.surfarray.blit_array(self.canvas, pixels[self.light_map])
+        self.screen.blit(self.canvas, CANVAS)
+        for label, pos in self.labels:
+            self.screen.blit(label, pos)
+        return [CANVAS]
+
+
+class FrameReader(object):
+    # Reads whole frames on a thread of its own, straight into a ring of
+    # buffer_frames slots, so the window keeps going while the producer
+    # catches up.  get() hands out a view of the oldest slot, which stays
+    # valid until the next get().  The thread owns fin; seek() just asks it
+    # to move and throws away whatever was read ahead.
+    #
+    # Frames that have been shown go into a history of the last
+    # history_frames, so going back a little works even on a pipe.
+    frame_count = None
+
+    def __init__(self, fin, buffer_frames=BUFFER_FRAMES, frame_bytes=BYTES_PER_FRAME,
+                 history_frames=HISTORY_FRAMES):
+        self.fin = fin
+        self.readinto = getattr(fin, 'readinto', None)
+        self.slots = numpy.empty((buffer_frames, frame_bytes), dtype=numpy.uint8)
+        self.frame_numbers = [0] * buffer_frames
+        self.head = 0
+        self.count = 0
+        self.holding = False
+
+        # history holds frames history_first up to history_first +
+        # history_count, oldest at history_head; replay is the next of them
+        # to show again, if we've gone back
+        self.history = numpy.empty((max(history_frames, 1), frame_bytes), dtype=numpy.uint8)
+        self.history_head = 0
+        self.history_count = 0
+        self.history_first = 0
+        self.replay = None
+
+        # the number of the next frame the thread will read
+        self.position = 0
+        self.seek_to = None
+        self.eof = False
+
+        # bumped by every seek, so a read that was under way when it
+        # happened is thrown away
+        self.generation = 0
+        self.condition = threading.Condition()
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _read_into(self, slot):
+        view = memoryview(slot)
+        filled = 0
+        while filled < len(slot):
+            if self.readinto:
+                n = self.readinto(view[filled:])
+            else:
+                data = self.fin.read(len(slot) - filled)
+                n = len(data)
+                slot[filled:filled + n] = numpy.frombuffer(data, dtype=numpy.uint8)
+            if not n:
+                return False
+            filled += n
+        return True
+
+    def _seek(self, frame_number):
+        try:
+            self.fin.seek(frame_number * self.slots.shape[1])
+            self.position = frame_number
+            return
+        except (IOError, OSError, AttributeError, ValueError):
+            pass
+        # not seekable, so go forward by reading, and backward not at all
+        scratch = numpy.empty(self.slots.shape[1], dtype=numpy.uint8)
+        while self.position < frame_number and self._read_into(scratch):
+            self.position += 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.seek_to is None and (self.eof or self.count == len(self.slots)):
+                    self.condition.wait()
+                seek_to, self.seek_to = self.seek_to, None
+                generation = self.generation
+                slot = (self.head + self.count) % len(self.slots)
+
+            if seek_to is not None:
+                self._seek(seek_to)
+                continue
+
+            ok = self._read_into(self.slots[slot])
+            frame_number = self.position
+            if ok:
+                self.position += 1
+
+            with self.condition:
+                if generation != self.generation:
+                    continue
+                if ok:
+                    self.frame_numbers[slot] = frame_number
+                    self.count += 1
+                else:
+                    self.eof = True
+                self.condition.notify_all()
+
+    def _remember(self, frame_number, frame):
+        if frame_number != self.history_first + self.history_count:
+            # a jump forward; history has to be one unbroken run
+            self.history_first = frame_number
+            self.history_count = 0
+        if self.history_count == len(self.history):
+            self.history_head = (self.history_head + 1) % len(self.history)
+            self.history_first += 1
+            self.history_count -= 1
+        slot = (self.history_head + self.history_count) % len(self.history)
+        self.history[slot] = frame
+        self.history_count += 1
+
+    def _release(self):
+        # the frame get() handed out last has been shown
+        if self.holding:
+            self._remember(self.frame_numbers[self.head], self.slots[self.head])
+            self.head = (self.head + 1) % len(self.slots)
+            self.count -= 1
+            self.holding = False
+            self.condition.notify_all()
+
+    def get(self):
+        # the next frame as (frame number, (lights, 3) array), or None if
+        # it hasn't been read yet
+        with self.condition:
+            self._release()
+
+            if self.replay is not None:
+                if self.replay < self.history_first + self.history_count:
+                    frame_number = self.replay
+                    self.replay += 1
+                    slot = (self.history_head + frame_number - self.history_first) % len(self.history)
+                    return frame_number, self.history[slot].reshape(-1, 3)
+                self.replay = None
+
+            if not self.count:
+                return None
+            self.holding = True
+            return (self.frame_numbers[self.head],
+                    self.slots[self.head].reshape(-1, 3))
+
+    def finished(self):
+        # true once everything's been shown
+        with self.condition:
+            return self.eof and self.replay is None and self.count - self.holding == 0
+
+    def seek(self, frame_number):
+        frame_number = max(frame_number, 0)
+        with self.condition:
+            self._release()
+
+            # somewhere we've already been, or already read.  Anything
+            # before the history is as far back as we can go.
+            history_end = self.history_first + self.history_count
+            if self.history_count and frame_number < history_end:
+                self.replay = max(frame_number, self.history_first)
+                return
+            self.replay = None
+            if self.count:
+                ahead = frame_number - self.frame_numbers[self.head]
+                if 0 <= ahead < self.count:
+                    self.head = (self.head + ahead) % len(self.slots)
+                    self.count -= ahead
+                    self.condition.notify_all()
+                    return
+
+            self.seek_to = frame_number
+            self.generation += 1
+            self.count = 0
+            self.eof = False
+            self.condition.notify_all()
+
+
+class RandomAccessFrames(object):
+    # For renders we can jump around in: a memory-mapped raw file, or a
+    # container with an index.  Nothing is read until it's shown, so
+    # going anywhere costs the same.
+    def __init__(self, read_frame, frame_count):
+        self.read_frame = read_frame
+        self.frame_count = frame_count
+        self.position = 0
+
+    def get(self):
+        if self.position >= self.frame_count:
+            return None
+        frame_number = self.position
+        self.position += 1
+        return frame_number, self.read_frame(frame_number)
+
+    def finished(self):
+        return self.position >= self.frame_count
+
+    def seek(self, frame_number):
+        self.position = min(max(frame_number, 0), max(self.frame_count - 1, 0))
+
+
+def open_frames(fin, container=None, buffer_frames=BUFFER_FRAMES, history_frames=HISTORY_FRAMES):
+    # the quickest way there is to get at the frames in fin
+    if container is not None and container.chunkIndex is not None:
+        def read_frame(frame_number):
+            frame = container.ReadFrame(frame_number)
+            return numpy.frombuffer(frame, dtype=numpy.uint8).reshape(-1, 3)
+        return RandomAccessFrames(read_frame, container.frameCount)
+
+    if container is None:
+        try:
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, OSError, ValueError):
+            # a pipe, or something else that isn't a plain file
+            mapped = None
+        if mapped is not None:
+            frames = numpy.frombuffer(mapped, dtype=numpy.uint8)
+            frames = frames[:len(frames) - len(frames) % BYTES_PER_FRAME].reshape(-1, NUM_PIXELS, 3)
+            return RandomAccessFrames(frames.__getitem__, len(frames))
+
+    return FrameReader(fin, buffer_frames, history_frames=history_frames)
+
+
+def frame_to_timestamp(framenum, fps=FPS):
+    usecs = framenum * 1000000 / fps
     seconds, usecs = divmod(usecs, 1000000)
     minutes, seconds = divmod(seconds, 60)
     hours, minutes = divmod(minutes, 60)
     return "%02d:%02d:%02d.%02d" % (hours, minutes, seconds, usecs / 10000)
 
-def run(fin, number_lights=False):
-    pygame.init()
-
-    screen = pygame.display.set_mode(SCREEN.size)
-
-    positions = {i: v for i, v in enumerate(CARTESIAN_COORDS)}
-
-    myfont = pygame.font.SysFont("monospace", 15)
-
-    framenum = 0
-
-    clock = pygame.time.Clock()
-    paused = False
-    while True:
-        # did the user close the window?
-        for event in pygame.event.get():
-            if event.type == pygame.locals.QUIT:
-                sys.exit(0)
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    paused = not paused
-
-        if paused:
-            continue
-
-        skip = 0
-        pressed = pygame.key.get_pressed()
-        if pressed[pygame.K_RIGHT]:
-            skip += 1
-        if pressed[pygame.K_LEFT]:
-            skip -= 1
-
-        if skip < 0:
-            # seeking backwards from current offset
-            for i in range(FRAMES_PER_SKIP):
+def timestamp_to_frame(timestamp, fps=FPS):
+    # [[hh:]mm:]ss[.ff] to a frame number; raises ValueError if it isn't one
+    seconds = 0.0
+    for field in timestamp.split(":"):
+        seconds = seconds * 60 + float(field)
+    return int(seconds * fps)
+
+def draw_seekbar(screen, framenum, frame_count):
+    screen.fill((0, 0, 0), SEEKBAR)
+    if not frame_count:
+        return
+    played = SEEKBAR.copy()
+    played.width = SEEKBAR.width * min(framenum + 1, frame_count) // frame_count
+    screen.fill((60, 60, 60), SEEKBAR.inflate(0, -4))
+    screen.fill((200, 200, 200), played.inflate(0, -4))
+
+def seekbar_frame(x, frame_count):
+    fraction = float(x - SEEKBAR.left) / SEEKBAR.width
+    return int(min(max(fraction, 0.0), 1.0) * (frame_count - 1))
+
+def wait_for_event(timeout):
+    # the next event, or NOEVENT after timeout seconds; None waits forever
+    if timeout is None:
+        return pygame.event.wait()
+    try:
+        return pygame.event.wait(max(int(timeout * 1000), 1))
+    except TypeError:
+        # pygame 1 can't time out a wait, so nap until there's something
+        deadline = monotonic() + timeout
+        while not pygame.event.peek() and monotonic() < deadline:
+            time.sleep(0.005)
+        return pygame.event.poll()
+
+class Viewer(object):
+    # Plays frames on a schedule of fps frames a second, by a monotonic
+    # clock.  Between frames, and the whole time it's paused, it sleeps
+    # waiting for events rather than polling for them.
+    def __init__(self, frames, number_lights=False, fps=FPS, use_surfarray=False):
+        self.frames = frames
+        self.fps = fps
+        self.period = 1.0 / fps
+
+        pygame.init()
+        self.screen = pygame.display.set_mode(SCREEN.size)
+        self.canvas = LightCanvas(self.screen, LAYOUT, number_lights, use_surfarray)
+        self.myfont = pygame.font.SysFont("monospace", 15)
+
+        # holding an arrow key keeps skipping, a frame's time apart
+        pygame.key.set_repeat(250, int(1000 * self.period))
+
+        self.framenum = 0
+        self.paused = False
+        self.buffering = False
+
+        # what's been typed after pressing g, or None when not typing
+        self.goto_text = None
+
+        # when each of the last second or so of frames went up, and how long
+        # getting and drawing them took on average
+        self.shown_at = collections.deque(maxlen=int(fps) + 1)
+        self.get_seconds = 0.0
+        self.draw_seconds = 0.0
+
+    def handle_event(self, event):
+        # returns a frame to seek to, if the event asks for one
+        if event.type == pygame.locals.QUIT:
+            sys.exit(0)
+        elif event.type == pygame.KEYDOWN and self.goto_text is not None:
+            if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                goto_text, self.goto_text = self.goto_text, None
                 try:
-                    fin.seek(skip * BYTES_PER_FRAME, 1)
-                    framenum += skip
-                except IOError:
-                    # No error at BOF, or if stream isn't seekable
+                    return timestamp_to_frame(goto_text, self.fps)
+                except ValueError:
                     pass
-        elif skip > 0:
-            # consume frames from the stream. Works even if not seekable.
-            for i in range(FRAMES_PER_SKIP):
-                fin.read(skip * BYTES_PER_FRAME)
-                framenum += 1
-
-        # update all the lights
-        for i, pos in positions.items():
-            screen_pos = convert_to_screen_pos(pos)
-
-            color = get_next_pixel(fin)
-
-            pygame.draw.circle(screen, color, screen_pos, 17)
-
-            if number_lights:
-                s = str(i)
-
-                label = myfont.render(s, 1, (255, 255, 255))
-
-                # center text on the light
-                x,y = screen_pos
-                x_s, y_s = myfont.size(s)
-                x, y = x-x_s/2, y-y_s/2
-
-                screen.blit(label, (x,y))
-
+            elif event.key == pygame.K_ESCAPE:
+                self.goto_text = None
+            elif event.key == pygame.K_BACKSPACE:
+                self.goto_text = self.goto_text[:-1]
+            elif event.unicode and event.unicode in "0123456789:.":
+                self.goto_text += event.unicode
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE:
+                self.paused = not self.paused
+            elif event.key == pygame.K_g:
+                self.goto_text = ""
+            elif event.key == pygame.K_RIGHT:
+                return self.framenum + SECONDS_PER_SKIP * int(self.fps)
+            elif event.key == pygame.K_LEFT:
+                # backwards on a pipe only goes as far back as the history
+                return self.framenum - SECONDS_PER_SKIP * int(self.fps)
+        elif (event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 or
+              event.type == pygame.MOUSEMOTION and event.buttons[0]):
+            if self.frames.frame_count and SEEKBAR.collidepoint(event.pos):
+                return seekbar_frame(event.pos[0], self.frames.frame_count)
+        return None
+
+    def show_next_frame(self):
+        # returns whether there was a frame to show
+        started = monotonic()
+        next_frame = self.frames.get()
+        got = monotonic()
+        if next_frame is None:
+            if self.frames.finished():
+                print("reached the end of the file")
+                sys.exit(0)
+            self.buffering = True
+            self.draw_status([])
+            return False
+
+        # update the lights that changed
+        self.buffering = False
+        self.framenum, frame = next_frame
+        self.draw_status(self.canvas.draw(frame))
+        done = monotonic()
+
+        self.shown_at.append(done)
+        self.get_seconds += 0.1 * (got - started - self.get_seconds)
+        self.draw_seconds += 0.1 * (done - got - self.draw_seconds)
+        return True
+
+    def measured_fps(self):
+        if len(self.shown_at) < 2 or self.paused:
+            return 0.0
+        return (len(self.shown_at) - 1) / (self.shown_at[-1] - self.shown_at[0])
+
+    def draw_status(self, dirty):
+        screen = self.screen
+        myfont = self.myfont
+
+        draw_seekbar(screen, self.framenum, self.frames.frame_count)
         screen.fill((0, 0, 0), STATUSBAR)
 
-        label_text = "frame %d" % framenum
+        if self.buffering and not self.paused:
+            # the producer's behind; say so rather than freeze
+            label_text = "buffering..."
+        else:
+            label_text = "frame %d" % self.framenum
         label = myfont.render(label_text, 1, (255, 255, 255))
         label_width, label_height = myfont.size(label_text)
         screen.blit(label, (STATUSBAR.right - label_width, STATUSBAR.bottom - label_height))
 
-        label_text = "%s" % frame_to_timestamp(framenum)
+        if self.goto_text is not None:
+            label_text = "go to: %s_" % self.goto_text
+        else:
+            label_text = "%s" % frame_to_timestamp(self.framenum, self.fps)
         label = myfont.render(label_text, 1, (255, 255, 255))
         label_width, label_height = myfont.size(label_text)
         screen.blit(label, (STATUSBAR.left, STATUSBAR.bottom - label_height))
 
-        framenum += 1
-
-        pygame.display.update()
-        clock.tick(FPS)
+        if self.paused:
+            label_text = "paused"
+        else:
+            label_text = "%4.1f fps  get %.1fms  draw %.1fms" % (
+                self.measured_fps(), self.get_seconds * 1000, self.draw_seconds * 1000)
+        label = myfont.render(label_text, 1, (160, 160, 160))
+        label_width, label_height = myfont.size(label_text)
+        screen.blit(label, (STATUSBAR.centerx - label_width // 2, STATUSBAR.bottom - label_height))
+
+        pygame.display.update(dirty + [SEEKBAR, STATUSBAR])
+
+    def run(self):
+        self.draw_status([])
+        next_due = monotonic()
+        while True:
+            if self.paused:
+                event = wait_for_event(None)
+            else:
+                event = wait_for_event(next_due - monotonic())
+
+            seek_to = None
+            while event.type != pygame.NOEVENT:
+                was_paused = self.paused
+                seek_to = self.handle_event(event)
+                if seek_to is not None:
+                    self.frames.seek(seek_to)
+                    self.show_next_frame()
+                    next_due = monotonic() + self.period
+                elif self.paused != was_paused:
+                    self.shown_at.clear()
+                    next_due = monotonic()
+                    self.draw_status([])
+                elif event.type == pygame.KEYDOWN:
+                    self.draw_status([])
+                event = pygame.event.poll()
+
+            if self.paused:
+                continue
+
+            now = monotonic()
+            if now < next_due:
+                continue
+            if self.show_next_frame():
+                next_due += self.period
+                # if we fell a whole frame behind, start again from now
+                # rather than rushing to catch up
+                if next_due < now:
+                    next_due = now + self.period
+            else:
+                # try again shortly, without holding up events
+                next_due = now + min(self.period, BUFFERING_RETRY_SECONDS)
+
+def run(frames, number_lights=False, fps=FPS, use_surfarray=False):
+    Viewer(frames, number_lights, fps, use_surfarray).run()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='View a data file')
     parser.add_argument('-n', '--number-lights', dest='number_lights',
                         action='store_true', default=False,
                         help='Label the lights with their index')
+    parser.add_argument('-s', '--surfarray', dest='use_surfarray',
+                        action='store_true', default=False,
+                        help='Draw whole frames with numpy instead of light by '
+                             'light; faster when most lights change every frame')
+    parser.add_argument('-b', '--buffer-frames', dest='buffer_frames', type=int,
+                        default=BUFFER_FRAMES,
+                        help='Read up to this many frames ahead of the display')
+    parser.add_argument('--history-frames', dest='history_frames', type=int,
+                        default=HISTORY_FRAMES,
+                        help='When reading a pipe, keep this many frames that have '
+                             'been shown, so you can go back through them')
     parser.add_argument('file', nargs='?',
                         type=argparse.FileType('rb'),
                         help='The file to view.  You can also pipe the file to the process.')
 
     args = parser.parse_args()
+    if args.buffer_frames < 1:
+        parser.error("--buffer-frames has to be at least 1")
 
     if args.file:
         fin = args.file
         print("reading from " + args.file.name)
     else:
-        fin = sys.stdin
+        fin = getattr(sys.stdin, 'buffer', sys.stdin)
         print("reading from stdin")
 
-    run(fin, number_lights=args.number_lights)
+    # Renders can be raw frames or an indexed container, which knows its
+    # own frame rate
+    fin, container = OpenRender(fin)
+    fps = FPS
+    if container:
+        fps = container.fps
+        print("render container: %d lights, %d fps, %d frames" % (
+            container.lightCount, container.fps, container.frameCount))
+        if container.lightCount != NUM_PIXELS:
+            # every frame would be cut up into lights at the wrong places
+            parser.error("render has %d lights, but the layout has %d" % (
+                container.lightCount, NUM_PIXELS))
+
+    frames = open_frames(fin, container, args.buffer_frames, args.history_frames)
+    run(frames, number_lights=args.number_lights, fps=fps, use_surfarray=args.use_surfarray)